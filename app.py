@@ -2,128 +2,506 @@ import os
 import hmac
 import hashlib
 import json
-from flask import Flask, request, jsonify
+import time
+import click
+import atexit
+import signal
+from contextlib import contextmanager, nullcontext
+import threading
+from collections import OrderedDict
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
+from markupsafe import escape
 from datetime import datetime
 
+from dedup import DedupIndex, delivery_key, event_key
+from event_store import create_event_store
+from events import BatchStats, describe, iter_entry_events, metric_labels, split_delivery, stream_delivery
+from event_log import EventLog, replay
+from forwarder import Forwarder
+from handlers import HandlerRegistry
+from ingest import IngestQueue
+from metrics import Metrics, PeakMemory, SIZE_BUCKETS
+from models import Quarantine
+from pages import CachedPage, PageCache
+from profiling import Profiler
+from ratelimit import RateLimiter, entry_cost
+from rollups import ALL_ACCOUNTS, RESOLUTIONS, Rollups
+from snapshot import StateSnapshot
+from tenants import TenantRegistry
+
 app = Flask(__name__)
+_started = time.perf_counter()
+_boot_id = time.time_ns()
 
 # Get from environment variables
 VERIFY_TOKEN = os.environ.get('VERIFY_TOKEN', 'my_verify_token_12345')
 APP_SECRET = os.environ.get('APP_SECRET', '')
 FB_APP_ID = os.environ.get('FB_APP_ID', '758214417322401')
 
-# Store recent webhooks for inspection
-recent_webhooks = []
-MAX_STORED_WEBHOOKS = 50
-
-
-def verify_signature(payload, signature):
-    """Verify the webhook signature using app secret"""
-    if not APP_SECRET:
-        app.logger.warning("APP_SECRET not set, skipping signature verification")
-        return True
-
-    expected_signature = hmac.new(
-        APP_SECRET.encode('utf-8'),
-        payload,
-        hashlib.sha256
-    ).hexdigest()
-
+# Serve several Meta apps from one process at /webhook/<app_id>. A JSON file
+# ({"<app_id>": {"verify_token": ..., "app_secret": ...}}) or an SQLite database
+# (.db/.sqlite) with an apps(app_id, verify_token, app_secret) table, reloaded
+# when it changes. /webhook keeps using the variables above
+TENANTS_CONFIG = os.environ.get('TENANTS_CONFIG', '')
+TENANTS_RELOAD_INTERVAL = float(os.environ.get('TENANTS_RELOAD_INTERVAL', 2.0))
+
+# Answer 401 to deliveries with an invalid signature instead of storing them as unverified
+STRICT_SIGNATURES = os.environ.get('STRICT_SIGNATURES', 'false').lower() == 'true'
+
+# JSON parser for webhook bodies: 'auto' uses orjson when it is installed
+JSON_BACKEND = os.environ.get('JSON_BACKEND', 'auto')
+
+# Request bodies over MAX_CONTENT_LENGTH bytes get a 413 before they are read.
+# JSON_STREAMING decodes a delivery one entry at a time instead of building the
+# whole tree, storing every STREAM_FLUSH_EVENTS events as it goes
+MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 8 * 1024 * 1024))
+READ_CHUNK_SIZE = 64 * 1024
+JSON_STREAMING = os.environ.get('JSON_STREAMING', 'false').lower() == 'true'
+STREAM_FLUSH_EVENTS = 100
+# Entries and items are checked against the event models before they're stored;
+# ones that fail are kept, with the reason, in a ring of QUARANTINE_SIZE
+VALIDATE_EVENTS = os.environ.get('VALIDATE_EVENTS', 'true').lower() == 'true'
+QUARANTINE_SIZE = int(os.environ.get('QUARANTINE_SIZE', 1000))
+# Record peak Python heap per request with tracemalloc (slows allocation)
+TRACK_REQUEST_MEMORY = os.environ.get('TRACK_REQUEST_MEMORY', 'false').lower() == 'true'
+
+# Store recent webhooks for inspection. The 'memory' backend is per-process,
+# 'compact' is a per-process store of raw bytes retained by a byte budget, and
+# 'sqlite' is shared by every gunicorn worker through a WAL-mode database file
+EVENT_STORE_BACKEND = os.environ.get('EVENT_STORE_BACKEND', 'memory')
+EVENT_STORE_PATH = os.environ.get('EVENT_STORE_PATH', '/tmp/webhook-events.db')
+MAX_STORED_WEBHOOKS = int(os.environ.get('MAX_STORED_WEBHOOKS', 50))
+MAX_WEBHOOK_AGE = int(os.environ.get('MAX_WEBHOOK_AGE', 0))  # seconds, 0 keeps events until evicted by count
+MAX_STORED_BYTES = int(os.environ.get('MAX_STORED_BYTES', 0))  # 'compact' backend only, 0 for no byte budget
+DASHBOARD_PAGE_SIZE = 20
+
+# Live dashboard feed. By default the dashboard polls /events every
+# DASHBOARD_POLL_SECONDS. An open /events/stream holds a whole sync gunicorn
+# worker (the default `gunicorn app:app` has one), so pushing over SSE is
+# opt-in via DASHBOARD_SSE for threaded/async workers (asgi.py serves the
+# stream on its event loop and turns it on). Streams end after
+# SSE_MAX_DURATION seconds, under gunicorn's 30s worker timeout, and the
+# browser reconnects where it left off
+DASHBOARD_SSE = os.environ.get('DASHBOARD_SSE', 'false').lower() == 'true'
+DASHBOARD_POLL_SECONDS = 5
+SSE_POLL_INTERVAL = float(os.environ.get('SSE_POLL_INTERVAL', 1.0))
+SSE_MAX_DURATION = float(os.environ.get('SSE_MAX_DURATION', 25))
+EVENTS_PAGE_LIMIT = 100
+
+# /events/search query parameters and the indexed event fields they match
+SEARCH_PARAMS = {
+    'object': 'object',
+    'field': 'field',
+    'account': 'object_id',
+    'sender': 'sender',
+    'media': 'media_id',
+}
+# Serialized JSON and dashboard HTML per event, a few times the event's size,
+# so only as many are kept as the store can still serve (up to 1000)
+FRAGMENT_CACHE_SIZE = max(DASHBOARD_PAGE_SIZE, min(MAX_STORED_WEBHOOKS, 1000))
+# /auth only depends on FB_APP_ID, so browsers may reuse it for a while
+AUTH_CACHE_CONTROL = 'public, max-age=300'
+
+# Drop redelivered webhooks. Whole deliveries are matched by a digest of the raw
+# body before parsing, individual events by message mid, comment id or digest
+DEDUP_ENABLED = os.environ.get('DEDUP_ENABLED', 'true').lower() == 'true'
+DEDUP_TTL = int(os.environ.get('DEDUP_TTL', 3600))
+DEDUP_MAX_KEYS = int(os.environ.get('DEDUP_MAX_KEYS', 100000))
+
+# Durable append-only log of verified payloads, replayable with `flask replay`.
+# Disabled unless EVENT_LOG_DIR is set
+EVENT_LOG_DIR = os.environ.get('EVENT_LOG_DIR', '')
+EVENT_LOG_SEGMENT_BYTES = int(os.environ.get('EVENT_LOG_SEGMENT_BYTES', 64 * 1024 * 1024))
+EVENT_LOG_SEGMENT_SECONDS = int(os.environ.get('EVENT_LOG_SEGMENT_SECONDS', 3600))
+EVENT_LOG_FSYNC_INTERVAL = float(os.environ.get('EVENT_LOG_FSYNC_INTERVAL', 0.05))
+EVENT_LOG_COMPRESS = os.environ.get('EVENT_LOG_COMPRESS', 'false').lower() == 'true'
+
+# Directory where each gunicorn worker publishes its metrics so /metrics can
+# sum them. Leave unset for a single process
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5.0))
+
+# Forward every stored event to downstream sinks, comma-separated
+# http(s)://host/path, unix:///path/to.sock or file:///path/events.ndjson
+FORWARD_SINKS = [uri.strip() for uri in os.environ.get('FORWARD_SINKS', '').split(',') if uri.strip()]
+FORWARD_BATCH_SIZE = int(os.environ.get('FORWARD_BATCH_SIZE', 100))
+FORWARD_BATCH_TIMEOUT = float(os.environ.get('FORWARD_BATCH_TIMEOUT', 1.0))
+FORWARD_MAX_RETRIES = int(os.environ.get('FORWARD_MAX_RETRIES', 5))
+FORWARD_QUEUE_SIZE = int(os.environ.get('FORWARD_QUEUE_SIZE', 10000))
+FORWARD_DEAD_LETTER_DIR = os.environ.get('FORWARD_DEAD_LETTER_DIR', '/tmp/webhook-dead-letter')
+
+# Ingestion mode: 'sync' processes webhooks inside the request, 'queue' acks
+# immediately and hands the raw body to a pool of background workers
+INGEST_MODE = os.environ.get('INGEST_MODE', 'sync')
+INGEST_QUEUE_SIZE = int(os.environ.get('INGEST_QUEUE_SIZE', 1000))
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 4))
+INGEST_BACKPRESSURE = os.environ.get('INGEST_BACKPRESSURE', 'block')  # block, shed or spill
+INGEST_BLOCK_TIMEOUT = float(os.environ.get('INGEST_BLOCK_TIMEOUT', 0.5))
+INGEST_SPILL_DIR = os.environ.get('INGEST_SPILL_DIR', '/tmp/webhook-spill')
+
+# Token-bucket limits per source IP (deliveries/second) and per page/IG account
+# in entry[].id (events/second), 0 disables. Throttled work is not dropped: it
+# goes to a single low-priority worker and spills to disk when that falls behind.
+# Past RATE_LIMIT_MAX_SPILL deliveries on disk, throttled IPs get a 429 so the
+# sender retries later (throttled account entries are dropped)
+RATE_LIMIT_IP = float(os.environ.get('RATE_LIMIT_IP', 0))
+RATE_LIMIT_IP_BURST = float(os.environ.get('RATE_LIMIT_IP_BURST', 0))  # defaults to the rate
+RATE_LIMIT_ACCOUNT = float(os.environ.get('RATE_LIMIT_ACCOUNT', 0))
+RATE_LIMIT_ACCOUNT_BURST = float(os.environ.get('RATE_LIMIT_ACCOUNT_BURST', 0))  # defaults to the rate
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 10000))
+RATE_LIMIT_QUEUE_SIZE = int(os.environ.get('RATE_LIMIT_QUEUE_SIZE', 1000))
+RATE_LIMIT_SPILL_DIR = os.environ.get('RATE_LIMIT_SPILL_DIR', '/tmp/webhook-deferred')
+RATE_LIMIT_MAX_SPILL = int(os.environ.get('RATE_LIMIT_MAX_SPILL', 10000))
+# Proxies in front of the app that append to X-Forwarded-For (1 on Render). The
+# client address is the hop that many from the end; with 0 the header is ignored
+# and the socket address is used, since without a proxy the client writes it
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 0))
+
+# Per-minute and per-hour event counts by (account, field) for /stats and the
+# dashboard, kept in fixed-size rings: about 6 KB per key with the defaults
+ROLLUP_MINUTES = int(os.environ.get('ROLLUP_MINUTES', 360))
+ROLLUP_HOURS = int(os.environ.get('ROLLUP_HOURS', 168))
+ROLLUP_MAX_KEYS = int(os.environ.get('ROLLUP_MAX_KEYS', 1000))
+STATS_DEFAULT_POINTS = {'minute': 60, 'hour': 24}
+DASHBOARD_ACTIVITY_ROWS = 10
+
+# Graceful shutdown: on SIGTERM (gunicorn's worker_exit hook, ASGI lifespan
+# shutdown or `python app.py`) new deliveries get a 503, queued work gets up to
+# SHUTDOWN_TIMEOUT seconds to finish, and with SNAPSHOT_DIR set the in-memory
+# store, dedup indexes, counters and still-queued deliveries are saved there
+# and restored in the background on the next start
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', '')
+SHUTDOWN_TIMEOUT = float(os.environ.get('SHUTDOWN_TIMEOUT', 20))
+SNAPSHOT_RESTORE_TIMEOUT = 30
+
+# Opt-in profiling of the webhook path: per-stage timings for every delivery,
+# stack sampling for PROFILE_SAMPLE_RATE of them, and deliveries slower than
+# PROFILE_SLOW_MS kept for /debug/slow
+PROFILING = os.environ.get('PROFILING', 'false').lower() == 'true'
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0.01))
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.001))
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', 250))
+PROFILE_RING_SIZE = int(os.environ.get('PROFILE_RING_SIZE', 100))
+
+# Business logic subscribed to (object, field) pairs. Comma-separated modules
+# that each define register(registry); handlers run after an event is stored
+EVENT_HANDLERS = [name.strip() for name in os.environ.get('EVENT_HANDLERS', '').split(',') if name.strip()]
+HANDLER_THREADS = int(os.environ.get('HANDLER_THREADS', 4))
+HANDLER_TIMEOUT = float(os.environ.get('HANDLER_TIMEOUT', 5.0))
+
+app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH or None
+
+
+if JSON_BACKEND in ('auto', 'orjson'):
+    try:
+        import orjson
+        json_loads = orjson.loads
+        json_dumps = orjson.dumps
+        JSON_BACKEND = 'orjson'
+    except ImportError:
+        if JSON_BACKEND == 'orjson':
+            raise
+        JSON_BACKEND = 'json'
+
+if JSON_BACKEND != 'orjson':
+    JSON_BACKEND = 'json'
+    json_loads = json.loads
+
+    def json_dumps(data):
+        return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+# Keyed HMAC state is built once; each request only copies it
+_hmac_base = hmac.new(APP_SECRET.encode('utf-8'), digestmod=hashlib.sha256) if APP_SECRET else None
+if not APP_SECRET:
+    app.logger.warning("APP_SECRET not set, skipping signature verification")
+
+
+def signature_digest(signature):
+    """Raw digest from an X-Hub-Signature-256 header, None if it is malformed"""
     # Signature comes as "sha256=<hash>"
     if signature.startswith('sha256='):
         signature = signature[7:]
 
-    return hmac.compare_digest(expected_signature, signature)
+    try:
+        return bytes.fromhex(signature)
+    except ValueError:
+        return None
+
+
+def signature_matches(mac, expected):
+    """Whether a body's running HMAC (None when APP_SECRET isn't set) matches the header digest"""
+    return mac is None or (expected is not None and hmac.compare_digest(mac.digest(), expected))
 
 
 @app.route('/')
 def index():
     """Show dashboard with recent webhooks"""
-    html = """
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Instagram Webhook POC</title>
-        <style>
-            body {{ font-family: Arial, sans-serif; margin: 20px; background: #f5f5f5; }}
-            .container {{ max-width: 1200px; margin: 0 auto; background: white; padding: 20px; border-radius: 8px; }}
-            h1 {{ color: #333; }}
-            .info-box {{ background: #e3f2fd; padding: 15px; border-radius: 5px; margin: 20px 0; }}
-            .webhook {{ background: #f9f9f9; padding: 15px; margin: 10px 0; border-left: 4px solid #4CAF50; border-radius: 4px; }}
-            .webhook-header {{ font-weight: bold; color: #333; margin-bottom: 10px; }}
-            pre {{ background: #263238; color: #aed581; padding: 15px; border-radius: 4px; overflow-x: auto; }}
-            .scopes {{ background: #fff3cd; padding: 15px; border-radius: 5px; margin: 20px 0; }}
-            .scope-item {{ margin: 5px 0; }}
-            .required {{ color: #d32f2f; font-weight: bold; }}
-            .optional {{ color: #f57c00; }}
-            .status {{ display: inline-block; padding: 3px 8px; border-radius: 3px; font-size: 12px; }}
-            .status-verified {{ background: #4CAF50; color: white; }}
-            .status-unverified {{ background: #ff9800; color: white; }}
-        </style>
-        <script>
-            // Auto-refresh every 5 seconds
-            setTimeout(function(){{ location.reload(); }}, 5000);
-        </script>
-    </head>
-    <body>
-        <div class="container">
-            <h1>Instagram Webhook POC</h1>
-            <p><a href="/auth" style="color: #1877f2; text-decoration: none; font-weight: bold;">→ Test Facebook Login & Scopes</a></p>
-
-            <div class="info-box">
-                <h3>Configuration</h3>
-                <p><strong>Webhook URL:</strong> {webhook_url}</p>
-                <p><strong>Verify Token:</strong> {verify_token}</p>
-                <p><strong>App Secret Configured:</strong> {app_secret_status}</p>
-            </div>
+    before = request.args.get('before', type=int)
 
-            <div class="scopes">
-                <h3>Required Scopes for Instagram Webhooks</h3>
-                <div class="scope-item"><span class="required">REQUIRED:</span> <code>instagram_basic</code> - Base Instagram access, enables mentions webhooks</div>
-                <div class="scope-item"><span class="required">REQUIRED:</span> <code>instagram_manage_messages</code> - Required for message/DM webhooks</div>
-                <div class="scope-item"><span class="required">REQUIRED:</span> <code>instagram_manage_comments</code> - Required for comment webhooks</div>
-                <div class="scope-item"><span class="optional">OPTIONAL:</span> <code>instagram_content_publish</code> - For content publishing</div>
-                <div class="scope-item"><span class="optional">OPTIONAL:</span> <code>instagram_manage_insights</code> - For analytics</div>
-                <div class="scope-item"><span class="required">REQUIRED:</span> <code>pages_show_list</code> - To list Facebook Pages</div>
-                <div class="scope-item"><span class="optional">HELPFUL:</span> <code>pages_read_engagement</code> - Additional engagement data</div>
-            </div>
+    # Everything on the page follows from these (the activity panel moves once
+    # a minute), so an unchanged tag means there is nothing to render
+    version = (os.getpid(), _boot_id, event_store.last_seq(), event_store.count(), before,
+               int(time.time() // 60), request.url_root)
+    etag = hashlib.blake2b(repr(version).encode('utf-8'), digest_size=16).hexdigest()
+    return dashboard_pages.response(etag, lambda: render_dashboard(before))
 
-            <h2>Recent Webhooks ({count})</h2>
-            <p style="color: #666;">Auto-refreshes every 5 seconds</p>
-            {webhooks_html}
-        </div>
-    </body>
-    </html>
+
+def render_dashboard(before):
+    page = event_store.recent(DASHBOARD_PAGE_SIZE, before=before)
+
+    webhooks_html = "".join(fragment_cache.get(wh)[1] for wh in page)
+
+    if not webhooks_html:
+        webhooks_html = "<p id='no-webhooks' style='color: #999;'>No webhooks received yet. Send a test webhook from Meta App Dashboard.</p>"
+
+    pager_html = ""
+    if before is not None:
+        pager_html += '<a href="/">← Newest</a> '
+    if len(page) == DASHBOARD_PAGE_SIZE:
+        pager_html += f'<a href="/?before={page[-1]["seq"]}">Older →</a>'
+
+    return render_template(
+        'dashboard.html',
+        webhook_url=request.url_root + 'webhook',
+        verify_token=VERIFY_TOKEN,
+        app_secret_status='Yes ✓' if APP_SECRET else 'No (set APP_SECRET env var)',
+        count=event_store.count(),
+        webhooks_html=webhooks_html,
+        activity_html=render_activity_html(),
+        pager_html=pager_html,
+        feed_status='Live updates' if before is None else 'Viewing older webhooks',
+        live='true' if before is None else 'false',
+        sse='true' if DASHBOARD_SSE else 'false',
+        poll_ms=int(DASHBOARD_POLL_SECONDS * 1000),
+        last_seq=page[0]['seq'] if page else event_store.last_seq(),
+        max_shown=EVENTS_PAGE_LIMIT
+    )
+
+
+class FragmentCache:
+    """LRU cache of each event's JSON and dashboard HTML, keyed by seq.
+
+    Events never change once stored, so each one is serialized once no matter
+    how many dashboards are watching.
     """
 
-    webhooks_html = ""
-    for wh in reversed(recent_webhooks[-20:]):  # Show last 20
-        webhooks_html += f"""
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, record):
+        """Return (json, html) for a stored event record"""
+        seq = record['seq']
+        with self._lock:
+            fragment = self._fragments.get(seq)
+            if fragment is not None:
+                self._fragments.move_to_end(seq)
+                return fragment
+
+        fragment = (json.dumps(record, default=str), render_event_html(record))
+        with self._lock:
+            self._fragments[seq] = fragment
+            if len(self._fragments) > self.maxsize:
+                self._fragments.popitem(last=False)
+        return fragment
+
+
+def render_event_html(wh):
+    """Dashboard HTML for a single stored event"""
+    meta = [f"#{wh['seq']}"]
+    if wh.get('object_id'):
+        meta.append(f"account {escape(wh['object_id'])}")
+    if wh.get('sender'):
+        meta.append(f"from {escape(wh['sender'])}")
+
+    return f"""
         <div class="webhook">
             <div class="webhook-header">
-                {wh['timestamp']} - {wh['type']}
+                {escape(wh['timestamp'])} - {escape(wh['type'])}
                 <span class="status status-{wh['signature_status']}">{wh['signature_status']}</span>
             </div>
-            <pre>{json.dumps(wh['data'], indent=2)}</pre>
+            <div class="webhook-meta">{' · '.join(meta)}</div>
+            <pre>{escape(json.dumps(wh['data'], indent=2))}</pre>
         </div>
         """
 
-    if not webhooks_html:
-        webhooks_html = "<p style='color: #999;'>No webhooks received yet. Send a test webhook from Meta App Dashboard.</p>"
 
-    return html.format(
-        webhook_url=request.url_root + 'webhook',
-        verify_token=VERIFY_TOKEN,
-        app_secret_status='Yes ✓' if APP_SECRET else 'No (set APP_SECRET env var)',
-        count=len(recent_webhooks),
-        webhooks_html=webhooks_html
+def sparkline(counts, width=180, height=28):
+    """Inline SVG line of a count series"""
+    peak = max(counts) or 1
+    step = width / max(len(counts) - 1, 1)
+    points = ' '.join(
+        f'{i * step:.1f},{height - 1 - count / peak * (height - 2):.1f}' for i, count in enumerate(counts)
+    )
+    return f'<svg class="sparkline" width="{width}" height="{height}"><polyline points="{points}"/></svg>'
+
+
+def render_activity_html():
+    """Dashboard panel with the busiest accounts and fields over the last hour"""
+    series = rollups.series('minute', STATS_DEFAULT_POINTS['minute'], limit=DASHBOARD_ACTIVITY_ROWS)
+    if not series:
+        return "<p style='color: #999;'>No events in the last hour.</p>"
+
+    rows = []
+    for row in series:
+        account = 'All accounts' if row['account'] == ALL_ACCOUNTS else escape(row['account'] or '-')
+        rows.append(
+            f"<tr><td>{account}</td><td>{escape(row['field'] or '-')}</td>"
+            f"<td>{row['total']}</td><td>{sparkline(row['counts'])}</td></tr>"
+        )
+    return f"""
+        <table class="activity">
+            <tr><th>Account</th><th>Field</th><th>Events</th><th>Per minute</th></tr>
+            {''.join(rows)}
+        </table>
+        """
+
+
+fragment_cache = FragmentCache(FRAGMENT_CACHE_SIZE)
+
+
+@app.route('/events')
+def events_feed():
+    """Events newer than ?since=<seq>, oldest first"""
+    since = request.args.get('since', 0, type=int)
+    limit = min(max(1, request.args.get('limit', EVENTS_PAGE_LIMIT, type=int)), EVENTS_PAGE_LIMIT)
+    records = event_store.since(since, limit)
+
+    # Splice the cached per-event JSON rather than re-encoding every record
+    if request.args.get('html'):
+        items = [json.dumps({'seq': r['seq'], 'html': fragment_cache.get(r)[1]}) for r in records]
+    else:
+        items = [fragment_cache.get(r)[0] for r in records]
+    last_seq = records[-1]['seq'] if records else since
+    body = f'{{"events": [{", ".join(items)}], "last_seq": {last_seq}, "count": {event_store.count()}}}'
+    return Response(body, mimetype='application/json')
+
+
+@app.route('/events/search')
+def events_search():
+    """Indexed search: ?object=&field=&account=&sender=&media=&since=&until= (epoch seconds), paged by ?before=<seq>"""
+    filters = {}
+    for param, name in SEARCH_PARAMS.items():
+        value = request.args.get(param)
+        if value:
+            filters[name] = value
+    limit = min(max(1, request.args.get('limit', EVENTS_PAGE_LIMIT, type=int)), EVENTS_PAGE_LIMIT)
+    records = event_store.search(
+        filters,
+        since=request.args.get('since', type=float),
+        until=request.args.get('until', type=float),
+        before=request.args.get('before', type=int),
+        limit=limit
+    )
+
+    items = [fragment_cache.get(r)[0] for r in records]
+    next_before = records[-1]['seq'] if len(records) == limit else None
+    body = f'{{"events": [{", ".join(items)}], "next_before": {json.dumps(next_before)}}}'
+    return Response(body, mimetype='application/json')
+
+
+@app.route('/stats')
+def stats_endpoint():
+    """Event counts per minute or hour by account and field, busiest first"""
+    resolution = request.args.get('resolution', 'minute')
+    if resolution not in RESOLUTIONS:
+        return jsonify({'error': f"resolution must be one of {', '.join(RESOLUTIONS)}"}), 400
+    points = max(1, request.args.get('points', STATS_DEFAULT_POINTS[resolution], type=int))
+    limit = min(max(1, request.args.get('limit', 20, type=int)), EVENTS_PAGE_LIMIT)
+
+    now = time.time()
+    width = RESOLUTIONS[resolution]
+    return jsonify({
+        'resolution': resolution,
+        'bucket_seconds': width,
+        'end': (int(now // width) + 1) * width,
+        'series': rollups.series(
+            resolution, points,
+            account=request.args.get('account'),
+            field=request.args.get('field'),
+            limit=limit,
+            now=now
+        ),
+    })
+
+
+@app.route('/quarantine')
+def quarantine_endpoint():
+    """Deliveries, entries and items that failed validation, newest first"""
+    level = request.args.get('level')
+    limit = min(max(1, request.args.get('limit', 50, type=int)), EVENTS_PAGE_LIMIT)
+    return jsonify({'stats': quarantine.stats(), 'items': quarantine.recent(limit, level)})
+
+
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+SSE_RETRY = 'retry: 1000\n\n'
+# Comment line keeps proxies from closing an idle stream
+SSE_KEEP_ALIVE = ': keep-alive\n\n'
+
+
+def sse_start_seq(last_event_id, since):
+    """Where a stream starts: the browser's Last-Event-ID on reconnect, else ?since=, else now"""
+    for value in (last_event_id, since):
+        if value and value.isdigit():
+            return int(value)
+    return event_store.last_seq()
+
+
+def sse_batch(last_seq):
+    """(SSE messages for events after `last_seq`, new last seq), ('', last_seq) if there are none"""
+    records = event_store.since(last_seq, EVENTS_PAGE_LIMIT)
+    if not records:
+        return '', last_seq
+    count = event_store.count()
+    messages = []
+    for r in records:
+        data = json.dumps({'seq': r['seq'], 'html': fragment_cache.get(r)[1], 'count': count})
+        messages.append(f"id: {r['seq']}\nevent: webhook\ndata: {data}\n\n")
+    return ''.join(messages), records[-1]['seq']
+
+
+@app.route('/events/stream')
+def events_stream():
+    """Server-Sent Events stream of new events as dashboard fragments"""
+    since = sse_start_seq(request.headers.get('Last-Event-ID'), request.args.get('since'))
+
+    def generate(last_seq):
+        deadline = time.monotonic() + SSE_MAX_DURATION
+        yield SSE_RETRY
+        while time.monotonic() < deadline:
+            messages, last_seq = sse_batch(last_seq)
+            if messages:
+                yield messages
+            else:
+                yield SSE_KEEP_ALIVE
+                time.sleep(SSE_POLL_INTERVAL)
+
+    return Response(
+        stream_with_context(generate(since)),
+        mimetype='text/event-stream',
+        headers=SSE_HEADERS
     )
 
 
 @app.route('/webhook', methods=['GET', 'POST'])
 def webhook():
     """Handle Instagram/Facebook webhook verification and events"""
+    return handle_webhook(VERIFY_TOKEN, _hmac_base)
+
+
+@app.route('/webhook/<app_id>', methods=['GET', 'POST'])
+def tenant_webhook(app_id):
+    """Webhook endpoint for one of the apps in TENANTS_CONFIG"""
+    tenant = tenants.get(app_id) if tenants is not None else None
+    if tenant is None:
+        return jsonify({'status': 'unknown app'}), 404
+    return handle_webhook(tenant.verify_token, tenant.hmac_base)
 
+
+def handle_webhook(verify_token, hmac_base):
+    """Verification handshake and event delivery for one app's credentials"""
     if request.method == 'GET':
         # Webhook verification
         mode = request.args.get('hub.mode')
@@ -132,7 +510,7 @@ def webhook():
 
         app.logger.info(f"Verification request: mode={mode}, token={token}")
 
-        if mode == 'subscribe' and token == VERIFY_TOKEN:
+        if mode == 'subscribe' and token == verify_token:
             app.logger.info("Webhook verified successfully!")
             return challenge, 200
         else:
@@ -140,404 +518,418 @@ def webhook():
             return 'Verification failed', 403
 
     elif request.method == 'POST':
-        # Webhook event received
-        signature = request.headers.get('X-Hub-Signature-256', '')
-        payload = request.get_data()
-
-        # Verify signature
-        signature_valid = verify_signature(payload, signature)
-
-        try:
-            data = request.get_json()
-
-            # Determine webhook type
-            webhook_type = 'Unknown'
-            if data.get('object') == 'instagram':
-                webhook_type = 'Instagram'
-            elif data.get('object') == 'page':
-                webhook_type = 'Facebook Page'
+        # Webhook event received; Meta retries anything that isn't a 200
+        if shutting_down.is_set():
+            return jsonify({'status': 'shutting down'}), 503
+        with trace('request'):
+            if request_memory is None:
+                return receive_delivery(hmac_base)
+            with request_memory.track():
+                return receive_delivery(hmac_base)
+
+
+@contextmanager
+def stage(name):
+    """Time a webhook processing stage for /metrics and the active profiler trace"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe('webhook_stage_seconds', elapsed, (name,))
+        if profiler is not None:
+            profiler.stage(name, elapsed)
+
+
+def trace(kind):
+    return profiler.trace(kind) if profiler is not None else nullcontext()
+
+
+def read_body(stream, mac):
+    """Read the request body in chunks, feeding each into `mac` as it arrives"""
+    chunks = []
+    while True:
+        chunk = stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            return b''.join(chunks)
+        if mac is not None:
+            mac.update(chunk)
+        chunks.append(chunk)
+
+
+def receive_delivery(hmac_base):
+    """Read, verify and hand off one POSTed delivery"""
+    started = time.perf_counter()
+    expected = signature_digest(request.headers.get('X-Hub-Signature-256', ''))
+
+    # The HMAC is computed while the body streams in; request.stream enforces
+    # MAX_CONTENT_LENGTH and doesn't keep a second cached copy of the body
+    mac = hmac_base.copy() if hmac_base is not None else None
+    with stage('read_body'):
+        payload = read_body(request.stream, mac)
+
+    # Verify signature
+    with stage('verify'):
+        signature_valid = signature_matches(mac, expected)
+    signature_status = 'verified' if signature_valid else 'unverified'
+    metrics.inc('webhook_deliveries_total', (signature_status,))
+    metrics.observe('webhook_request_bytes', len(payload))
+    if profiler is not None:
+        profiler.annotate(bytes=len(payload), signature=signature_status, ingest=INGEST_MODE)
+
+    if STRICT_SIGNATURES and not signature_valid:
+        metrics.observe('webhook_ack_seconds', time.perf_counter() - started)
+        return jsonify({'status': 'invalid signature'}), 401
+
+    if event_log is not None and signature_valid:
+        event_log.append(payload, signature_valid)
+
+    if ip_limiter is not None and not ip_limiter.allow(client_ip()):
+        metrics.inc('webhook_throttled_total', ('ip',))
+        if not deferred_queue.put(payload, signature_valid):
+            return throttled_response()
+    elif ingest_queue is not None:
+        ingest_queue.put(payload, signature_valid)
+    else:
+        process_webhook(payload, signature_valid)
+
+    # Always return 200 to acknowledge receipt
+    metrics.observe('webhook_ack_seconds', time.perf_counter() - started)
+    return jsonify({'status': 'ok'}), 200
+
+
+@app.errorhandler(413)
+def payload_too_large(e):
+    metrics.inc('webhook_rejected_total', ('too_large',))
+    return jsonify({'status': 'payload too large', 'max_content_length': MAX_CONTENT_LENGTH}), 413
+
+
+def forwarded_client(forwarded, remote_addr, hops=TRUSTED_PROXY_HOPS):
+    """Address a delivery came from: the X-Forwarded-For entry added by the
+    outermost of `hops` trusted proxies. Hops before it are whatever the sender
+    put in the header, so with fewer entries than that the socket address is used"""
+    addrs = forwarded.rsplit(',', hops) if hops > 0 else []
+    if len(addrs) >= hops > 0 and addrs[-hops].strip():
+        return addrs[-hops].strip()
+    return remote_addr or ''
+
+
+def client_ip():
+    return forwarded_client(request.headers.get('X-Forwarded-For', ''), request.remote_addr)
+
+
+def throttled_response():
+    # The deferred backlog is full, so have the sender retry later instead
+    metrics.inc('webhook_rejected_total', ('throttled',))
+    return jsonify({'status': 'rate limited'}), 429
+
+
+def throttle_entries(obj, entries, signature_valid, deferred):
+    """Yield entries of accounts within their rate limit and defer the rest.
 
-            # Extract event details
-            if 'entry' in data and len(data['entry']) > 0:
-                entry = data['entry'][0]
+    Deferred entries are collected in `deferred` and queued as one delivery
+    once `entries` is exhausted.
+    """
+    for entry in entries:
+        if isinstance(entry, dict) and 'id' in entry and not account_limiter.allow(str(entry['id']), entry_cost(entry)):
+            deferred.append(entry)
+        else:
+            yield entry
+
+    if deferred:
+        metrics.inc('webhook_throttled_total', ('account',), len(deferred))
+        deferred_queue.put(json_dumps({'object': obj, 'entry': deferred}), signature_valid)
+
+
+def store_records(records):
+    """Store events, then hand them to the forwarder and event handlers"""
+    with stage('store'):
+        event_store.extend(records)
+    with stage('dispatch'):
+        if forwarder is not None:
+            forwarder.submit(records)
+        registry.dispatch(records)
+
+
+def process_deferred(payload, signature_valid):
+    """Process throttled work without charging the rate limits again"""
+    process_webhook(payload, signature_valid, throttle=False)
+
+
+def process_webhook(payload, signature_valid, throttle=True):
+    """Parse a raw webhook delivery and store one event per entry item"""
+    if state_snapshot is not None:
+        state_snapshot.wait(SNAPSHOT_RESTORE_TIMEOUT)
+
+    # Joins the request's trace in sync mode, traces the worker run otherwise
+    with trace('process'):
+        _process_webhook(payload, signature_valid, throttle)
+
+
+def _process_webhook(payload, signature_valid, throttle):
+    signature_status = 'verified' if signature_valid else 'unverified'
+    try:
+        # Only verified deliveries enter the dedup index, so a forged copy can't
+        # shadow the genuine one
+        dedup = DEDUP_ENABLED and signature_valid
+        if dedup and delivery_index.seen(delivery_key(payload)):
+            app.logger.info("Duplicate webhook delivery ignored")
+            return
+
+        with stage('parse'):
+            if JSON_STREAMING:
+                data = None
+                obj, entries = stream_delivery(payload)
+            else:
+                data = json_loads(payload)
+                obj, entries = split_delivery(data)
+
+        if not isinstance(obj, str):
+            quarantine_delivery('missing object' if obj is None else 'object must be str', payload, signature_status)
+            return
+
+        if profiler is not None:
+            entries = profiler.count(entries, 'entries')
+
+        deferred = []
+        # Only verified deliveries are charged, so forged traffic naming a real
+        # entry.id can't use up that account's budget (the IP limit covers it)
+        if throttle and signature_valid and account_limiter is not None:
+            entries = throttle_entries(obj, entries, signature_valid, deferred)
+
+        def fallback():
+            # Nothing to record when every entry was deferred by the rate limit
+            if deferred:
+                return None
+            return data if data is not None else json_loads(payload)
+
+        def on_invalid(level, reason, field, object_id, item):
+            quarantine.add(level, reason, obj, field, object_id, signature_status, item)
+            metrics.inc('webhook_quarantined_total', (level,))
+
+        # Meta batches many entries (each with many changes/messaging items) per delivery
+        timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')
+        records = []
+        stored = 0
+        types = set()
+        fields = set()
+        with stage('classify'):
+            for event in iter_entry_events(obj, entries, fallback, on_invalid, VALIDATE_EVENTS):
+                if dedup and event_index.seen(event_key(event)):
+                    continue
+                event['timestamp'] = timestamp
+                event['type'] = describe(event['object'], event['field'])
+                event['signature_status'] = signature_status
+                records.append(event)
+                types.add(event['type'])
+                fields.add(event['field'])
+                rollups.record(event['object_id'], event['field'])
+                metrics.inc('webhook_events_total', (*metric_labels(event['object'], event['field']), signature_status))
+
+                # Streamed deliveries are stored in slices so parsed entries can be freed
+                if JSON_STREAMING and len(records) >= STREAM_FLUSH_EVENTS:
+                    store_records(records)
+                    stored += len(records)
+                    records = []
+
+        if records:
+            store_records(records)
+            stored += len(records)
+        if profiler is not None:
+            profiler.annotate(bytes=len(payload), events=stored, fields=sorted(fields))
+        if not stored and deferred:
+            return
+        batch_stats.record(stored)
+
+        app.logger.info(f"Webhook received: {stored} event(s) {', '.join(sorted(types))} (signature: {signature_valid})")
+
+    except ValueError as e:
+        # Includes a streamed delivery that turns out to be malformed part way through
+        quarantine_delivery(f'invalid JSON: {str(e)}', payload, signature_status)
+    except Exception as e:
+        app.logger.error(f"Error processing webhook: {str(e)}")
+
+
+def quarantine_delivery(reason, payload, signature_status):
+    app.logger.warning(f"Webhook delivery quarantined: {reason}")
+    quarantine.add('delivery', reason, signature_status=signature_status, data=payload)
+    metrics.inc('webhook_quarantined_total', ('delivery',))
+
+
+metrics = Metrics(directory=METRICS_DIR or None, flush_interval=METRICS_FLUSH_INTERVAL)
+metrics.counter('webhook_deliveries_total', 'Webhook POST deliveries received', ('signature',))
+metrics.counter('webhook_events_total', 'Events stored, by object, field and signature status',
+                ('object', 'field', 'signature'))
+metrics.histogram('webhook_request_bytes', 'Webhook request body size in bytes', buckets=SIZE_BUCKETS)
+metrics.histogram('webhook_ack_seconds', 'Time from request start to acknowledgement')
+metrics.histogram('webhook_stage_seconds', 'Time spent in each webhook processing stage', ('stage',))
+metrics.counter('webhook_rejected_total', 'Deliveries rejected before processing', ('reason',))
+metrics.histogram('webhook_peak_memory_bytes', 'Peak Python heap growth per request (TRACK_REQUEST_MEMORY)',
+                  buckets=SIZE_BUCKETS)
+metrics.counter('webhook_throttled_total', 'Deliveries (ip) or entries (account) deferred by rate limits',
+                ('limit',))
+metrics.counter('webhook_quarantined_total', 'Deliveries, entries or items that failed validation', ('level',))
+
+profiler = None
+if PROFILING:
+    profiler = Profiler(
+        sample_rate=PROFILE_SAMPLE_RATE,
+        interval=PROFILE_INTERVAL,
+        slow_ms=PROFILE_SLOW_MS,
+        ring_size=PROFILE_RING_SIZE
+    )
 
-                # Check for Instagram messaging
-                if 'messaging' in entry:
-                    webhook_type += ' - Messages'
-                # Check for Instagram changes (comments/mentions)
-                elif 'changes' in entry:
-                    changes = entry['changes']
-                    if changes and len(changes) > 0:
-                        field = changes[0].get('field', '')
-                        webhook_type += f' - {field.title()}'
+request_memory = None
+if TRACK_REQUEST_MEMORY:
+    request_memory = PeakMemory(on_peak=lambda peak: metrics.observe('webhook_peak_memory_bytes', peak))
+
+event_store = create_event_store(
+    EVENT_STORE_BACKEND,
+    path=EVENT_STORE_PATH,
+    max_events=MAX_STORED_WEBHOOKS,
+    max_age=MAX_WEBHOOK_AGE,
+    max_bytes=MAX_STORED_BYTES,
+    dumps=json_dumps,
+    loads=json_loads
+)
+
+batch_stats = BatchStats()
+quarantine = Quarantine(maxsize=QUARANTINE_SIZE)
+
+forwarder = None
+if FORWARD_SINKS:
+    forwarder = Forwarder(
+        FORWARD_SINKS,
+        batch_size=FORWARD_BATCH_SIZE,
+        batch_timeout=FORWARD_BATCH_TIMEOUT,
+        max_retries=FORWARD_MAX_RETRIES,
+        queue_size=FORWARD_QUEUE_SIZE,
+        dead_letter_dir=FORWARD_DEAD_LETTER_DIR
+    )
 
-            # Store webhook
-            webhook_entry = {
-                'timestamp': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC'),
-                'type': webhook_type,
-                'signature_status': 'verified' if signature_valid else 'unverified',
-                'data': data
-            }
+event_log = None
+if EVENT_LOG_DIR:
+    event_log = EventLog(
+        EVENT_LOG_DIR,
+        max_segment_bytes=EVENT_LOG_SEGMENT_BYTES,
+        max_segment_age=EVENT_LOG_SEGMENT_SECONDS,
+        fsync_interval=EVENT_LOG_FSYNC_INTERVAL,
+        compress=EVENT_LOG_COMPRESS
+    )
 
-            recent_webhooks.append(webhook_entry)
+registry = HandlerRegistry(threads=HANDLER_THREADS, default_timeout=HANDLER_TIMEOUT)
+registry.load(EVENT_HANDLERS)
+
+delivery_index = DedupIndex(max_keys=DEDUP_MAX_KEYS, ttl=DEDUP_TTL)
+event_index = DedupIndex(max_keys=DEDUP_MAX_KEYS, ttl=DEDUP_TTL)
+
+ingest_queue = None
+if INGEST_MODE == 'queue':
+    ingest_queue = IngestQueue(
+        process_webhook,
+        maxsize=INGEST_QUEUE_SIZE,
+        workers=INGEST_WORKERS,
+        policy=INGEST_BACKPRESSURE,
+        block_timeout=INGEST_BLOCK_TIMEOUT,
+        spill_dir=INGEST_SPILL_DIR
+    )
 
-            # Keep only recent webhooks
-            if len(recent_webhooks) > MAX_STORED_WEBHOOKS:
-                recent_webhooks.pop(0)
+tenants = None
+if TENANTS_CONFIG:
+    tenants = TenantRegistry(TENANTS_CONFIG, check_interval=TENANTS_RELOAD_INTERVAL)
+
+rollups = Rollups(minutes=ROLLUP_MINUTES, hours=ROLLUP_HOURS, max_keys=ROLLUP_MAX_KEYS)
+
+ip_limiter = None
+if RATE_LIMIT_IP > 0:
+    ip_limiter = RateLimiter(RATE_LIMIT_IP, RATE_LIMIT_IP_BURST, max_keys=RATE_LIMIT_MAX_KEYS)
+
+account_limiter = None
+if RATE_LIMIT_ACCOUNT > 0:
+    account_limiter = RateLimiter(RATE_LIMIT_ACCOUNT, RATE_LIMIT_ACCOUNT_BURST, max_keys=RATE_LIMIT_MAX_KEYS)
+
+# One worker, so throttled work never competes with the normal path for more than a thread
+deferred_queue = None
+if ip_limiter is not None or account_limiter is not None:
+    deferred_queue = IngestQueue(
+        process_deferred,
+        maxsize=RATE_LIMIT_QUEUE_SIZE,
+        workers=1,
+        policy='spill',
+        spill_dir=RATE_LIMIT_SPILL_DIR,
+        max_spill=RATE_LIMIT_MAX_SPILL
+    )
 
-            app.logger.info(f"Webhook received: {webhook_type} (signature: {signature_valid})")
+shutting_down = threading.Event()
 
-        except Exception as e:
-            app.logger.error(f"Error processing webhook: {str(e)}")
+dashboard_pages = PageCache()
 
-        # Always return 200 to acknowledge receipt
-        return jsonify({'status': 'ok'}), 200
+# Rendered and compressed once; every request is a cache hit or a 304
+with app.app_context():
+    auth_page = CachedPage(
+        render_template('auth.html', fb_app_id=FB_APP_ID),
+        cache_control=AUTH_CACHE_CONTROL,
+        precompress=True
+    )
 
+state_snapshot = None
+if SNAPSHOT_DIR:
+    state_snapshot = StateSnapshot(SNAPSHOT_DIR, {
+        'event_store': event_store,
+        'delivery_index': delivery_index,
+        'event_index': event_index,
+        'batch_stats': batch_stats,
+        'rollups': rollups,
+        'quarantine': quarantine,
+    }, on_pending=process_webhook)
 
-@app.route('/auth')
-def auth_test():
-    """Facebook Login test page"""
-    html = """
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Instagram/Facebook Auth Test</title>
-        <style>
-            body {{ font-family: Arial, sans-serif; margin: 20px; background: #f5f5f5; }}
-            .container {{ max-width: 1000px; margin: 0 auto; background: white; padding: 30px; border-radius: 8px; }}
-            h1 {{ color: #333; }}
-            .section {{ margin: 30px 0; padding: 20px; background: #f9f9f9; border-radius: 5px; }}
-            .scopes {{ background: #fff3cd; padding: 15px; border-radius: 5px; margin: 20px 0; }}
-            .scope-item {{ margin: 5px 0; }}
-            .required {{ color: #d32f2f; font-weight: bold; }}
-            button {{ background: #1877f2; color: white; border: none; padding: 12px 24px;
-                      font-size: 16px; border-radius: 5px; cursor: pointer; margin: 10px 5px; }}
-            button:hover {{ background: #166fe5; }}
-            button:disabled {{ background: #ccc; cursor: not-allowed; }}
-            .result {{ background: #e8f5e9; padding: 15px; border-radius: 5px; margin: 10px 0; }}
-            .error {{ background: #ffebee; color: #c62828; padding: 15px; border-radius: 5px; margin: 10px 0; }}
-            pre {{ background: #263238; color: #aed581; padding: 15px; border-radius: 4px; overflow-x: auto; }}
-            .token {{ word-break: break-all; font-family: monospace; font-size: 12px; }}
-            .info {{ background: #e3f2fd; padding: 15px; border-radius: 5px; margin: 10px 0; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>Instagram/Facebook Auth Test</h1>
-            <p><a href="/">← Back to Webhook Dashboard</a></p>
-
-            <div class="info">
-                <h3>Testing Facebook Login for Instagram API</h3>
-                <p>This page helps you test the Facebook Login flow and verify which scopes are granted.</p>
-                <p><strong>App ID:</strong> {FB_APP_ID}</p>
-            </div>
 
-            <div class="scopes">
-                <h3>Scopes We'll Request</h3>
-                <div class="scope-item"><span class="required">Core:</span> <code>instagram_basic</code> - Base Instagram access</div>
-                <div class="scope-item"><span class="required">Core:</span> <code>instagram_manage_messages</code> - DM webhooks</div>
-                <div class="scope-item"><span class="required">Core:</span> <code>instagram_manage_comments</code> - Comment webhooks & management</div>
-                <div class="scope-item"><span class="required">Core:</span> <code>pages_show_list</code> - List Facebook Pages</div>
-                <div class="scope-item"><span class="required">Core:</span> <code>pages_read_engagement</code> - Page engagement data</div>
-                <div class="scope-item"><span class="required">Core:</span> <code>pages_manage_metadata</code> - Manage page metadata</div>
-                <div class="scope-item"><span class="required">Core:</span> <code>business_management</code> - Manage Business assets</div>
-                <div class="scope-item">Optional: <code>instagram_content_publish</code> - Publish content</div>
-            </div>
+def start_worker():
+    """Per-process startup of a serving process: gunicorn worker, ASGI lifespan or dev server"""
+    if state_snapshot is not None:
+        state_snapshot.start_restore()
 
-            <div class="section">
-                <h3>Step 1: Login with Facebook</h3>
-                <button id="loginBtn" onclick="fbLogin()">Login with Facebook</button>
-                <div id="loginStatus"></div>
-            </div>
 
-            <div class="section">
-                <h3>Step 2: Check Granted Permissions</h3>
-                <button id="checkPermsBtn" onclick="checkPermissions()" disabled>Check My Permissions</button>
-                <div id="permissionsResult"></div>
-            </div>
+def shutdown(timeout=SHUTDOWN_TIMEOUT, pending=()):
+    """Stop taking deliveries, drain queued work and snapshot state.
 
-            <div class="section">
-                <h3>Step 3: Get Instagram Business Account</h3>
-                <button id="getIgBtn" onclick="getInstagramAccount()" disabled>Get Instagram Business Account</button>
-                <div id="igAccountResult"></div>
-            </div>
+    Runs once; returns (seconds taken, deliveries left pending), or None if a
+    shutdown already happened.
+    """
+    if shutting_down.is_set():
+        return None
+    shutting_down.set()
+    started = time.perf_counter()
+    deadline = time.monotonic() + timeout
+
+    # Deliveries that can't be processed in time go into the snapshot
+    pending = list(pending)
+    for work_queue in (ingest_queue, deferred_queue):
+        if isinstance(work_queue, IngestQueue):
+            pending.extend(work_queue.drain(max(0.0, deadline - time.monotonic())))
+    if forwarder is not None:
+        forwarder.drain(max(0.0, deadline - time.monotonic()))
+    if event_log is not None:
+        event_log.close()
+    metrics.flush()
+
+    if state_snapshot is not None and state_snapshot.active():
+        try:
+            state_snapshot.save(pending)
+        except OSError as e:
+            app.logger.error(f"Failed to save state snapshot: {str(e)}")
+    elif pending:
+        app.logger.warning(f"Shutting down with {len(pending)} unprocessed deliveries (set SNAPSHOT_DIR to keep them)")
 
-            <div class="section">
-                <h3>Alternative Method: Manual API Test</h3>
-                <p>If Step 3 shows 0 pages, try this alternative approach using Graph API Explorer:</p>
-                <ol style="text-align: left;">
-                    <li>Go to <a href="https://developers.facebook.com/tools/explorer" target="_blank">Graph API Explorer</a></li>
-                    <li>Select your app: <strong>{FB_APP_ID}</strong></li>
-                    <li>Click "Generate Access Token"</li>
-                    <li>Grant permissions: <code>pages_show_list</code>, <code>instagram_basic</code>, <code>business_management</code>, <code>pages_manage_metadata</code></li>
-                    <li>In the query box, enter: <code>me/accounts?fields=id,name,instagram_business_account</code></li>
-                    <li>Click "Submit" and see if your page appears</li>
-                </ol>
-                <p style="margin-top: 15px;">Copy your access token from Graph Explorer:</p>
-                <input type="text" id="manualToken" placeholder="Paste access token here" style="width: 100%; padding: 10px; margin: 5px 0; font-family: monospace; font-size: 12px;">
-                <button onclick="testManualToken()">Test This Token</button>
-                <div id="manualTestResult"></div>
-            </div>
+    elapsed = time.perf_counter() - started
+    app.logger.info(f"Drained in {elapsed * 1000:.0f} ms, {len(pending)} deliveries left pending")
+    return elapsed, len(pending)
 
-            <div class="section">
-                <h3>Step 4: Subscribe to Webhooks (Manual)</h3>
-                <p>After getting your Instagram Business Account ID above, you can subscribe to webhooks:</p>
-                <pre id="curlCommand">Loading...</pre>
-                <button onclick="copyToClipboard()">Copy Command</button>
-            </div>
-        </div>
 
-        <script>
-            let accessToken = null;
-            let userId = null;
-            let pages = [];
-            let igAccountId = null;
-
-            window.fbAsyncInit = function() {{
-                FB.init({{
-                    appId      : '{FB_APP_ID}',
-                    cookie     : true,
-                    xfbml      : true,
-                    version    : 'v21.0'
-                }});
-
-                // Check login status on load
-                FB.getLoginStatus(function(response) {{
-                    if (response.status === 'connected') {{
-                        accessToken = response.authResponse.accessToken;
-                        userId = response.authResponse.userID;
-                        showLoginSuccess();
-                    }}
-                }});
-            }};
-
-            (function(d, s, id){{
-                var js, fjs = d.getElementsByTagName(s)[0];
-                if (d.getElementById(id)) return;
-                js = d.createElement(s); js.id = id;
-                js.src = "https://connect.facebook.net/en_US/sdk.js";
-                fjs.parentNode.insertBefore(js, fjs);
-            }}(document, 'script', 'facebook-jssdk'));
-
-            function fbLogin() {{
-                FB.login(function(response) {{
-                    if (response.status === 'connected') {{
-                        accessToken = response.authResponse.accessToken;
-                        userId = response.authResponse.userID;
-                        showLoginSuccess();
-                    }} else {{
-                        document.getElementById('loginStatus').innerHTML =
-                            '<div class="error">Login failed or was cancelled</div>';
-                    }}
-                }}, {{
-                    scope: 'instagram_basic,instagram_manage_messages,instagram_manage_comments,pages_show_list,pages_read_engagement,pages_manage_metadata,instagram_content_publish,business_management',
-                    auth_type: 'rerequest'
-                }});
-            }}
-
-            function showLoginSuccess() {{
-                document.getElementById('loginStatus').innerHTML =
-                    '<div class="result"><strong>✓ Login successful!</strong><br>' +
-                    'User ID: ' + userId + '<br>' +
-                    'Access Token: <span class="token">' + accessToken + '</span></div>';
-                document.getElementById('checkPermsBtn').disabled = false;
-                document.getElementById('getIgBtn').disabled = false;
-            }}
-
-            function checkPermissions() {{
-                FB.api('/me/permissions', function(response) {{
-                    if (response && !response.error) {{
-                        let granted = [];
-                        let declined = [];
-
-                        response.data.forEach(function(perm) {{
-                            if (perm.status === 'granted') {{
-                                granted.push(perm.permission);
-                            }} else {{
-                                declined.push(perm.permission);
-                            }}
-                        }});
-
-                        let html = '<div class="result">';
-                        html += '<h4>Granted Permissions (' + granted.length + '):</h4>';
-                        html += '<pre>' + JSON.stringify(granted, null, 2) + '</pre>';
-
-                        if (declined.length > 0) {{
-                            html += '<h4>Declined Permissions:</h4>';
-                            html += '<pre>' + JSON.stringify(declined, null, 2) + '</pre>';
-                        }}
-                        html += '</div>';
-
-                        document.getElementById('permissionsResult').innerHTML = html;
-                    }} else {{
-                        document.getElementById('permissionsResult').innerHTML =
-                            '<div class="error">Error: ' + JSON.stringify(response.error) + '</div>';
-                    }}
-                }});
-            }}
-
-            function getInstagramAccount() {{
-                // First get Facebook Pages
-                FB.api('/me/accounts', {{ fields: 'id,name,access_token,instagram_business_account' }}, function(response) {{
-                    let html = '';
-
-                    // Debug: Show raw response
-                    html += '<div class="info" style="margin-bottom: 15px;">';
-                    html += '<h4>🔍 Debug: Raw API Response</h4>';
-                    html += '<pre style="max-height: 200px; overflow-y: auto;">' + JSON.stringify(response, null, 2) + '</pre>';
-                    html += '</div>';
-
-                    if (response && response.error) {{
-                        html += '<div class="error">';
-                        html += '<strong>API Error:</strong><br>';
-                        html += 'Code: ' + response.error.code + '<br>';
-                        html += 'Message: ' + response.error.message + '<br>';
-                        html += 'Type: ' + response.error.type + '<br>';
-                        html += '</div>';
-                        document.getElementById('igAccountResult').innerHTML = html;
-                        return;
-                    }}
-
-                    if (response && response.data) {{
-                        pages = response.data;
-                        html += '<div class="result">';
-                        html += '<h4>Facebook Pages (' + pages.length + '):</h4>';
-
-                        if (pages.length === 0) {{
-                            html += '<div class="error">';
-                            html += '<strong>No Pages Found</strong><br>';
-                            html += '<p>Possible reasons:</p>';
-                            html += '<ul style="text-align: left; margin-left: 20px;">';
-                            html += '<li>You do not have any Facebook Pages where you are an Admin or Editor</li>';
-                            html += '<li>Your app needs to be added to Business Manager</li>';
-                            html += '<li>Try adding <code>pages_manage_metadata</code> permission</li>';
-                            html += '</ul>';
-                            html += '<p><strong>Next steps:</strong></p>';
-                            html += '<ol style="text-align: left; margin-left: 20px;">';
-                            html += '<li>Go to <a href="https://www.facebook.com/pages" target="_blank">facebook.com/pages</a></li>';
-                            html += '<li>Create a new Page if you do not have one</li>';
-                            html += '<li>Make sure you are an Admin on the page</li>';
-                            html += '<li>Try the "Alternative Method" below</li>';
-                            html += '</ol>';
-                            html += '</div>';
-                        }} else {{
-                            pages.forEach(function(page) {{
-                                html += '<div style="margin: 10px 0; padding: 10px; background: white; border-radius: 4px;">';
-                                html += '<strong>' + page.name + '</strong><br>';
-                                html += 'Page ID: ' + page.id + '<br>';
-
-                                if (page.instagram_business_account) {{
-                                    igAccountId = page.instagram_business_account.id;
-                                    html += '<span style="color: green;">✓ Instagram Business Account Connected!</span><br>';
-                                    html += 'Instagram Business Account ID: <strong>' + page.instagram_business_account.id + '</strong><br>';
-
-                                    // Get Instagram account details
-                                    getIgAccountDetails(page.instagram_business_account.id, page.access_token);
-
-                                    // Update curl command - USE PAGE ID, not IG account ID!
-                                    updateCurlCommand(page.access_token, page.id, page.instagram_business_account.id);
-                                }} else {{
-                                    html += '<span style="color: orange;">⚠ No Instagram Business Account connected</span><br>';
-                                }}
-                                html += '</div>';
-                            }});
-                        }}
-
-                        html += '</div>';
-                    }} else {{
-                        html += '<div class="error">Unexpected response format</div>';
-                    }}
-
-                    document.getElementById('igAccountResult').innerHTML = html;
-                }});
-            }}
-
-            function getIgAccountDetails(igAccountId, pageAccessToken) {{
-                fetch('https://graph.facebook.com/v21.0/' + igAccountId +
-                      '?fields=id,username,name,profile_picture_url&access_token=' + pageAccessToken)
-                    .then(response => response.json())
-                    .then(data => {{
-                        let html = '<div class="result" style="margin-top: 10px;">';
-                        html += '<h4>Instagram Account Details:</h4>';
-                        html += '<pre>' + JSON.stringify(data, null, 2) + '</pre>';
-                        html += '</div>';
-
-                        let currentHtml = document.getElementById('igAccountResult').innerHTML;
-                        document.getElementById('igAccountResult').innerHTML = currentHtml + html;
-                    }});
-            }}
-
-            function updateCurlCommand(pageAccessToken, pageId, igAccountId) {{
-                let cmd = `# IMPORTANT: Subscribe using Facebook PAGE ID, not Instagram Account ID!\\n\\n`;
-                cmd += `# Subscribe to Instagram webhooks via Facebook Page\\n`;
-                cmd += `curl -X POST "https://graph.facebook.com/v21.0/${{pageId}}/subscribed_apps" \\\\\\n`;
-                cmd += `  -d "access_token=${{pageAccessToken}}" \\\\\\n`;
-                cmd += `  -d "subscribed_fields=messages,comments,mentions"\\n\\n`;
-                cmd += `# Check subscription status\\n`;
-                cmd += `curl "https://graph.facebook.com/v21.0/${{pageId}}/subscribed_apps?access_token=${{pageAccessToken}}"\\n\\n`;
-                cmd += `# For reference:\\n`;
-                cmd += `# Facebook Page ID: ${{pageId}}\\n`;
-                cmd += `# Instagram Business Account ID: ${{igAccountId}}`;
-
-                cmd = cmd.replace(/\\${{pageId}}/g, pageId);
-                cmd = cmd.replace(/\\${{igAccountId}}/g, igAccountId);
-                cmd = cmd.replace(/\\${{pageAccessToken}}/g, pageAccessToken);
-
-                document.getElementById('curlCommand').textContent = cmd;
-            }}
-
-            function testManualToken() {{
-                let token = document.getElementById('manualToken').value.trim();
-                if (!token) {{
-                    document.getElementById('manualTestResult').innerHTML =
-                        '<div class="error">Please paste an access token</div>';
-                    return;
-                }}
-
-                fetch('https://graph.facebook.com/v21.0/me/accounts?fields=id,name,access_token,instagram_business_account&access_token=' + token)
-                    .then(response => response.json())
-                    .then(data => {{
-                        let html = '<div class="result" style="margin-top: 10px;">';
-                        html += '<h4>Manual Token Test Result:</h4>';
-                        html += '<pre>' + JSON.stringify(data, null, 2) + '</pre>';
-
-                        if (data.data && data.data.length > 0) {{
-                            html += '<div style="margin-top: 10px; padding: 10px; background: #e8f5e9; border-radius: 4px;">';
-                            html += '<strong style="color: green;">✓ Success! Found ' + data.data.length + ' page(s)</strong>';
-
-                            data.data.forEach(function(page) {{
-                                if (page.instagram_business_account) {{
-                                    html += '<p>Facebook Page ID: <strong>' + page.id + '</strong></p>';
-                                    html += '<p>Instagram Business Account ID: <strong>' + page.instagram_business_account.id + '</strong></p>';
-                                    updateCurlCommand(page.access_token, page.id, page.instagram_business_account.id);
-                                }}
-                            }});
-                            html += '</div>';
-                        }}
-                        html += '</div>';
-                        document.getElementById('manualTestResult').innerHTML = html;
-                    }})
-                    .catch(error => {{
-                        document.getElementById('manualTestResult').innerHTML =
-                            '<div class="error">Error: ' + error.message + '</div>';
-                    }});
-            }}
-
-            function copyToClipboard() {{
-                let text = document.getElementById('curlCommand').textContent;
-                navigator.clipboard.writeText(text).then(function() {{
-                    alert('Copied to clipboard!');
-                }});
-            }}
-
-            // Initialize curl command placeholder
-            document.getElementById('curlCommand').textContent =
-                '# Complete steps 1-3 first to generate subscription commands';
-        </script>
-    </body>
-    </html>
-    """.format(FB_APP_ID=FB_APP_ID)
-    return html
+@app.route('/auth')
+def auth_test():
+    """Facebook Login test page"""
+    return auth_page.response()
 
 
 @app.route('/health')
@@ -545,13 +937,105 @@ def health():
     """Health check endpoint"""
     return jsonify({
         'status': 'healthy',
-        'webhooks_received': len(recent_webhooks),
+        'webhooks_received': event_store.count(),
+        'event_store': event_store.stats(),
+        'batches': batch_stats.stats(),
+        'dedup': {
+            'enabled': DEDUP_ENABLED,
+            'deliveries': delivery_index.stats(),
+            'events': event_index.stats(),
+        },
         'verify_token_set': bool(VERIFY_TOKEN),
         'app_secret_set': bool(APP_SECRET),
-        'fb_app_id': FB_APP_ID
+        'strict_signatures': STRICT_SIGNATURES,
+        'json_backend': JSON_BACKEND,
+        'json_streaming': JSON_STREAMING,
+        'max_content_length': MAX_CONTENT_LENGTH,
+        'request_memory': request_memory.stats() if request_memory is not None else None,
+        'profiling': profiler.stats() if profiler is not None else None,
+        'fb_app_id': FB_APP_ID,
+        'tenants': tenants.stats() if tenants is not None else None,
+        'ingest': ingest_queue.stats() if ingest_queue is not None else {'mode': 'sync'},
+        'event_log': event_log.stats() if event_log is not None else None,
+        'forwarding': forwarder.stats() if forwarder is not None else None,
+        'handlers': registry.stats(),
+        'rollups': rollups.stats(),
+        'quarantine': quarantine.stats(),
+        'dashboard_cache': dashboard_pages.stats(),
+        'snapshot': state_snapshot.stats() if state_snapshot is not None else None,
+        'rate_limits': {
+            'ip': ip_limiter.stats() if ip_limiter is not None else None,
+            'account': account_limiter.stats() if account_limiter is not None else None,
+            'deferred': deferred_queue.stats() if deferred_queue is not None else None,
+        }
     })
 
 
+@app.route('/debug/slow')
+def debug_slow():
+    """Slow deliveries captured by the profiler, newest first"""
+    if profiler is None:
+        return jsonify({'error': 'profiling is disabled, set PROFILING=true'}), 404
+    return jsonify({'profiling': profiler.stats(), 'slow': profiler.slow_requests()})
+
+
+@app.route('/debug/slow/flamegraph')
+def debug_flamegraph():
+    """Folded stacks for flamegraph.pl or speedscope, for one slow delivery (?id=) or all sampled ones"""
+    if profiler is None:
+        return jsonify({'error': 'profiling is disabled, set PROFILING=true'}), 404
+
+    folded = None
+    slow_id = request.args.get('id', type=int)
+    if slow_id is not None:
+        record = profiler.find(slow_id)
+        if record is None:
+            return jsonify({'error': f'no slow delivery {slow_id}'}), 404
+        folded = record['folded'] or {}
+
+    name = f'webhook-slow-{slow_id}' if slow_id is not None else 'webhook-profile'
+    response = Response(profiler.render_folded(folded), mimetype='text/plain')
+    response.headers['Content-Disposition'] = f'attachment; filename={name}.folded'
+    return response
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics, summed across gunicorn workers when METRICS_DIR is set"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.cli.command('replay')
+@click.option('--dir', 'directory', default=EVENT_LOG_DIR, help='Event log directory (defaults to EVENT_LOG_DIR)')
+@click.option('--rate', default=0.0, help='Maximum deliveries per second, 0 for unlimited')
+def replay_command(directory, rate):
+    """Replay logged webhook deliveries through the normal processing path"""
+    if not directory:
+        raise click.UsageError('No event log directory, set EVENT_LOG_DIR or pass --dir')
+
+    started = time.monotonic()
+    count = replay(directory, process_webhook, rate=rate)
+    # Forwarded events and handler work are still queued in background threads
+    shutdown()
+    click.echo(f"Replayed {count} deliveries in {time.monotonic() - started:.2f}s")
+
+
+startup_seconds = time.perf_counter() - _started
+app.logger.info(f"Started in {startup_seconds * 1000:.0f} ms (pid {os.getpid()})")
+
+
 if __name__ == '__main__':
+    # debug=True normally runs this module twice: a reloader that watches files
+    # and the child that serves (WERKZEUG_RUN_MAIN=true). The reloader kills
+    # the child outright when it gets SIGTERM, so with snapshots on it's
+    # turned off and the one process drains and saves at exit
+    use_reloader = not SNAPSHOT_DIR
+    if not use_reloader or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        def on_sigterm(signum, frame):
+            raise SystemExit(0)
+
+        signal.signal(signal.SIGTERM, on_sigterm)
+        atexit.register(shutdown)
+        start_worker()
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    app.run(host='0.0.0.0', port=port, debug=True, use_reloader=use_reloader)
@@ -0,0 +1,257 @@
+"""ASGI entry point.
+
+POST /webhook is handled natively on the event loop: the body is read
+(and hashed) as it arrives, the signature verified and the raw delivery queued for consumer tasks before
+the 200 goes out. /events/stream is also served on the event loop, so an
+open dashboard stream holds no thread. Every other route is served by the
+Flask app, each request on its own executor thread.
+
+    uvicorn asgi:application --host 0.0.0.0 --port $PORT
+    gunicorn asgi:application -k uvicorn.workers.UvicornWorker
+"""
+import os
+import json
+import time
+import asyncio
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+import app as receiver
+from ingest import AsyncIngestQueue
+
+
+class _WsgiInstance(WsgiToAsgiInstance):
+    # asgiref runs every WSGI call on one shared thread by default, so a single
+    # slow request would hold up every other Flask route for every client
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False)
+
+
+class _WsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await _WsgiInstance(self.wsgi_application)(scope, receive, send)
+
+
+flask_application = _WsgiToAsgi(receiver.app)
+
+# Streams cost no thread here, so the dashboard can have events pushed to it
+if 'DASHBOARD_SSE' not in os.environ:
+    receiver.DASHBOARD_SSE = True
+
+
+async def _process(payload, signature_valid):
+    # Parsing, validation, storage, handlers and forwarding take milliseconds
+    # for a large batch, so they run in the default executor and the event
+    # loop stays free to ack other deliveries
+    await asyncio.get_running_loop().run_in_executor(None, receiver.process_webhook, payload, signature_valid)
+
+
+ingest_queue = AsyncIngestQueue(
+    _process,
+    maxsize=receiver.INGEST_QUEUE_SIZE,
+    workers=receiver.INGEST_WORKERS,
+    policy=receiver.INGEST_BACKPRESSURE,
+    block_timeout=receiver.INGEST_BLOCK_TIMEOUT,
+    spill_dir=receiver.INGEST_SPILL_DIR
+)
+
+# /health reports whichever ingest queue is in use
+receiver.ingest_queue = ingest_queue
+
+
+async def _respond(send, status, body, content_type=b'application/json'):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type), (b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+# _read_body() result for a body over MAX_CONTENT_LENGTH
+TOO_LARGE = object()
+
+
+async def _read_body(receive, mac, limit):
+    """Body of the request, fed into `mac` as it arrives; None if the client went away"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if limit and size > limit:
+            return TOO_LARGE
+        if mac is not None:
+            mac.update(chunk)
+        chunks.append(chunk)
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+async def _too_large(send):
+    receiver.metrics.inc('webhook_rejected_total', ('too_large',))
+    await _respond(send, 413, json.dumps({
+        'status': 'payload too large', 'max_content_length': receiver.MAX_CONTENT_LENGTH
+    }).encode())
+
+
+def _client_ip(scope, headers):
+    client = scope.get('client')
+    return receiver.forwarded_client(headers.get(b'x-forwarded-for', b'').decode('latin-1'), client[0] if client else '')
+
+
+async def webhook(scope, receive, send, verify_token, hmac_base):
+    """asyncio-native version of app.handle_webhook()"""
+    if scope['method'] == 'GET':
+        # Webhook verification
+        args = parse_qs(scope['query_string'].decode('latin-1'))
+        mode = args.get('hub.mode', [None])[0]
+        token = args.get('hub.verify_token', [None])[0]
+        challenge = args.get('hub.challenge', [''])[0]
+
+        if mode == 'subscribe' and token == verify_token:
+            receiver.app.logger.info("Webhook verified successfully!")
+            await _respond(send, 200, challenge.encode('utf-8'), b'text/html; charset=utf-8')
+        else:
+            receiver.app.logger.error("Webhook verification failed!")
+            await _respond(send, 403, b'Verification failed', b'text/html; charset=utf-8')
+        return
+
+    if scope['method'] != 'POST':
+        await _respond(send, 405, b'Method not allowed', b'text/plain')
+        return
+
+    if receiver.shutting_down.is_set():
+        await _respond(send, 503, json.dumps({'status': 'shutting down'}).encode())
+        return
+
+    ingest_queue.start()
+    metrics = receiver.metrics
+    started = time.perf_counter()
+    headers = dict(scope['headers'])
+    expected = receiver.signature_digest(headers.get(b'x-hub-signature-256', b'').decode('latin-1'))
+
+    limit = receiver.MAX_CONTENT_LENGTH
+    length = headers.get(b'content-length', b'')
+    if limit and length.isdigit() and int(length) > limit:
+        await _too_large(send)
+        return
+
+    mac = hmac_base.copy() if hmac_base is not None else None
+    payload = await _read_body(receive, mac, limit)
+    if payload is None:
+        return
+    if payload is TOO_LARGE:
+        await _too_large(send)
+        return
+    metrics.observe('webhook_stage_seconds', time.perf_counter() - started, ('read_body',))
+
+    with metrics.timer('webhook_stage_seconds', ('verify',)):
+        signature_valid = receiver.signature_matches(mac, expected)
+    signature_status = 'verified' if signature_valid else 'unverified'
+    metrics.inc('webhook_deliveries_total', (signature_status,))
+    metrics.observe('webhook_request_bytes', len(payload))
+
+    if receiver.STRICT_SIGNATURES and not signature_valid:
+        metrics.observe('webhook_ack_seconds', time.perf_counter() - started)
+        await _respond(send, 401, json.dumps({'status': 'invalid signature'}).encode())
+        return
+
+    if receiver.event_log is not None and signature_valid:
+        receiver.event_log.append(payload, signature_valid)
+
+    if receiver.ip_limiter is not None and not receiver.ip_limiter.allow(_client_ip(scope, headers)):
+        metrics.inc('webhook_throttled_total', ('ip',))
+        if not receiver.deferred_queue.put(payload, signature_valid):
+            metrics.inc('webhook_rejected_total', ('throttled',))
+            await _respond(send, 429, json.dumps({'status': 'rate limited'}).encode())
+            return
+    else:
+        await ingest_queue.put(payload, signature_valid)
+
+    # Always return 200 to acknowledge receipt
+    metrics.observe('webhook_ack_seconds', time.perf_counter() - started)
+    await _respond(send, 200, json.dumps({'status': 'ok'}).encode())
+
+
+async def events_stream(scope, receive, send):
+    """asyncio-native version of app.events_stream()"""
+    loop = asyncio.get_running_loop()
+    headers = dict(scope['headers'])
+    args = parse_qs(scope['query_string'].decode('latin-1'))
+    last_seq = await loop.run_in_executor(
+        None, receiver.sse_start_seq,
+        headers.get(b'last-event-id', b'').decode('latin-1'), args.get('since', [None])[0]
+    )
+
+    disconnected = asyncio.Event()
+
+    async def watch():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+
+    async def write(text, more_body=True):
+        await send({'type': 'http.response.body', 'body': text.encode('utf-8'), 'more_body': more_body})
+
+    watcher = asyncio.create_task(watch())
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'text/event-stream; charset=utf-8')] + [
+                (name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in receiver.SSE_HEADERS.items()
+            ],
+        })
+        await write(receiver.SSE_RETRY)
+        deadline = loop.time() + receiver.SSE_MAX_DURATION
+        while loop.time() < deadline and not disconnected.is_set():
+            messages, last_seq = await loop.run_in_executor(None, receiver.sse_batch, last_seq)
+            await write(messages or receiver.SSE_KEEP_ALIVE)
+            if not messages:
+                try:
+                    await asyncio.wait_for(disconnected.wait(), receiver.SSE_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        await write('', more_body=False)
+    except OSError:
+        # The client went away while we were writing
+        pass
+    finally:
+        watcher.cancel()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            receiver.start_worker()
+            ingest_queue.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            # Deliveries still queued at the deadline are kept in the snapshot
+            pending = await ingest_queue.stop(receiver.SHUTDOWN_TIMEOUT)
+            await asyncio.get_running_loop().run_in_executor(None, receiver.shutdown, receiver.SHUTDOWN_TIMEOUT, pending)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    elif scope['type'] == 'http' and scope['path'] == '/webhook':
+        await webhook(scope, receive, send, receiver.VERIFY_TOKEN, receiver._hmac_base)
+    elif scope['type'] == 'http' and scope['path'].startswith('/webhook/') and receiver.tenants is not None:
+        tenant = receiver.tenants.get(scope['path'][len('/webhook/'):])
+        if tenant is None:
+            await _respond(send, 404, json.dumps({'status': 'unknown app'}).encode())
+        else:
+            await webhook(scope, receive, send, tenant.verify_token, tenant.hmac_base)
+    elif scope['type'] == 'http' and scope['path'] == '/events/stream':
+        await events_stream(scope, receive, send)
+    else:
+        await flask_application(scope, receive, send)
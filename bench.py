@@ -0,0 +1,320 @@
+"""Load generator and benchmark for the /webhook endpoint.
+
+Generates signed Instagram/Page deliveries and drives them against the app,
+either in-process through the Flask test client or over a local socket
+against a gunicorn/uvicorn server, then reports throughput, ack latency
+percentiles and RSS growth. Each --config runs with its own environment so
+worker counts, store backends, JSON parsers etc. can be compared side by side.
+
+    python bench.py --requests 2000 --batch 1
+    python bench.py --mode socket --batch 1000 --requests 50 \\
+        --config memory:EVENT_STORE_BACKEND=memory \\
+        --config sqlite-4w:EVENT_STORE_BACKEND=sqlite,workers=4
+    python bench.py --validation --batch 1000 --requests 200
+"""
+import os
+import sys
+import json
+import hmac
+import time
+import socket
+import hashlib
+import argparse
+import threading
+import subprocess
+import http.client
+import urllib.request
+
+BENCH_SECRET = 'bench-secret'
+KINDS = ('comments', 'mentions', 'messages')
+
+
+def make_item(kind, n):
+    """One changes/messaging item with ids unique to `n`"""
+    now = int(time.time())
+    if kind == 'messages':
+        return {
+            'sender': {'id': f'user-{n % 5000}'},
+            'recipient': {'id': 'business-1'},
+            'timestamp': now * 1000,
+            'message': {'mid': f'mid.{n}', 'text': f'Hello from benchmark {n}'},
+        }
+    if kind == 'comments':
+        return {
+            'field': 'comments',
+            'value': {
+                'id': f'comment-{n}',
+                'from': {'id': f'user-{n % 5000}', 'username': f'user{n % 5000}'},
+                'media': {'id': f'media-{n % 50}', 'media_product_type': 'FEED'},
+                'text': f'Great post! #{n}',
+            },
+        }
+    return {
+        'field': 'mentions',
+        'value': {'media_id': f'media-{n % 50}', 'comment_id': f'mention-{n}'},
+    }
+
+
+def make_payload(seq, batch=1, kind='mixed', obj='instagram', accounts=10):
+    """A delivery with `batch` entries of one item each"""
+    entries = []
+    for i in range(batch):
+        n = seq * batch + i
+        item_kind = KINDS[n % len(KINDS)] if kind == 'mixed' else kind
+        entry = {'id': f'account-{n % accounts}', 'time': int(time.time())}
+        entry['messaging' if item_kind == 'messages' else 'changes'] = [make_item(item_kind, n)]
+        entries.append(entry)
+    return json.dumps({'object': obj, 'entry': entries}).encode('utf-8')
+
+
+def sign(payload, secret=BENCH_SECRET):
+    return 'sha256=' + hmac.new(secret.encode('utf-8'), payload, hashlib.sha256).hexdigest()
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def rss_kb(pid):
+    """Resident set size of a process and all its descendants, in kB"""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+            with open(f'/proc/{current}/task/{current}/children') as f:
+                pending.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return total
+
+
+def summarize(latencies, elapsed, opts, rss_before, rss_after):
+    latencies.sort()
+    requests = len(latencies)
+    return {
+        'requests': requests,
+        'events': requests * opts.batch,
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(requests / elapsed, 1) if elapsed else 0.0,
+        'events_per_second': round(requests * opts.batch / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'p999_ms': round(percentile(latencies, 0.999) * 1000, 3),
+        'rss_before_kb': rss_before,
+        'rss_after_kb': rss_after,
+        'rss_growth_kb': rss_after - rss_before,
+    }
+
+
+def run_inprocess(opts):
+    """Drive the Flask app through its test client in this process"""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import logging
+    logging.disable(logging.INFO)
+    import app as receiver
+
+    client = receiver.app.test_client()
+    payloads = [make_payload(seq, opts.batch, opts.kind, opts.object) for seq in range(opts.requests)]
+    headers = [{'X-Hub-Signature-256': sign(p), 'Content-Type': 'application/json'} for p in payloads]
+
+    rss_before = rss_kb(os.getpid())
+    latencies = []
+    started = time.perf_counter()
+    for payload, header in zip(payloads, headers):
+        t = time.perf_counter()
+        client.post('/webhook', data=payload, headers=header)
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - started
+    return summarize(latencies, elapsed, opts, rss_before, rss_kb(os.getpid()))
+
+
+def run_validation(opts):
+    """Time normalizing one delivery's events with and without schema validation"""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from events import iter_entry_events
+
+    data = json.loads(make_payload(0, opts.batch, opts.kind, opts.object))
+    timings = {}
+    for validate in (False, True, False, True):
+        started = time.perf_counter()
+        for _ in range(opts.requests):
+            for _ in iter_entry_events(data['object'], data['entry'], validate=validate):
+                pass
+        # Best of two rounds each, to keep warm-up out of the comparison
+        elapsed = (time.perf_counter() - started) / opts.requests
+        timings[validate] = min(elapsed, timings.get(validate, elapsed))
+
+    per_1000 = 1000 / opts.batch
+    return {
+        'batch': opts.batch,
+        'batches': opts.requests,
+        'normalize_ms_per_1000': round(timings[False] * per_1000 * 1000, 3),
+        'validated_ms_per_1000': round(timings[True] * per_1000 * 1000, 3),
+        'overhead_ms_per_1000': round((timings[True] - timings[False]) * per_1000 * 1000, 3),
+        'overhead_pct': round((timings[True] / timings[False] - 1) * 100, 1),
+    }
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_for(port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'Server on port {port} did not start')
+
+
+def run_socket(opts, env, server='gunicorn', workers=1):
+    """Start a local server with `env` and drive it over HTTP keep-alive connections"""
+    port = _free_port()
+    here = os.path.dirname(os.path.abspath(__file__))
+    if server == 'uvicorn':
+        cmd = [sys.executable, '-m', 'uvicorn', 'asgi:application', '--port', str(port),
+               '--workers', str(workers), '--log-level', 'warning']
+    else:
+        target = 'asgi:application' if server == 'gunicorn-uvicorn' else 'app:app'
+        cmd = [sys.executable, '-m', 'gunicorn', target, '--bind', f'127.0.0.1:{port}',
+               '--workers', str(workers), '--log-level', 'warning']
+        if server == 'gunicorn-uvicorn':
+            cmd += ['-k', 'uvicorn.workers.UvicornWorker']
+
+    proc = subprocess.Popen(cmd, cwd=here, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        _wait_for(port)
+        payloads = [make_payload(seq, opts.batch, opts.kind, opts.object) for seq in range(opts.requests)]
+        signatures = [sign(p) for p in payloads]
+        rss_before = rss_kb(proc.pid)
+
+        latencies = []
+        lock = threading.Lock()
+        next_index = iter(range(len(payloads)))
+
+        def client():
+            conn = http.client.HTTPConnection('127.0.0.1', port)
+            mine = []
+            while True:
+                with lock:
+                    i = next(next_index, None)
+                if i is None:
+                    break
+                t = time.perf_counter()
+                conn.request('POST', '/webhook', body=payloads[i], headers={
+                    'X-Hub-Signature-256': signatures[i], 'Content-Type': 'application/json'
+                })
+                conn.getresponse().read()
+                mine.append(time.perf_counter() - t)
+            conn.close()
+            with lock:
+                latencies.extend(mine)
+
+        threads = [threading.Thread(target=client) for _ in range(opts.concurrency)]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        # Let queued work finish before sampling memory
+        time.sleep(0.5)
+        return summarize(latencies, elapsed, opts, rss_before, rss_kb(proc.pid))
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+
+def parse_config(spec):
+    """'label:KEY=VAL,KEY=VAL' -> (label, env overrides, server options)"""
+    label, _, assignments = spec.partition(':')
+    env, options = {}, {}
+    for assignment in filter(None, assignments.split(',')):
+        key, _, value = assignment.partition('=')
+        if key in ('workers', 'server'):
+            options[key] = value
+        else:
+            env[key] = value
+    return label, env, options
+
+
+def run_config(opts, label, overrides, options):
+    env = dict(os.environ, APP_SECRET=BENCH_SECRET)
+    env.update(overrides)
+
+    if opts.mode == 'socket':
+        result = run_socket(opts, env, options.get('server', opts.server), int(options.get('workers', opts.workers)))
+    else:
+        # A fresh interpreter per config so app.py reads its environment at import
+        cmd = [sys.executable, os.path.abspath(__file__), '--child'] + opts.passthrough
+        out = subprocess.run(cmd, env=env, capture_output=True, text=True, check=True).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+    result['config'] = label
+    return result
+
+
+def print_table(results):
+    columns = ('config', 'requests', 'events_per_second', 'requests_per_second',
+               'p50_ms', 'p99_ms', 'p999_ms', 'rss_growth_kb')
+    widths = [max(len(c), *(len(str(r[c])) for r in results)) for c in columns]
+    print('  '.join(c.ljust(w) for c, w in zip(columns, widths)))
+    for r in results:
+        print('  '.join(str(r[c]).ljust(w) for c, w in zip(columns, widths)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the /webhook endpoint')
+    parser.add_argument('--mode', choices=('inprocess', 'socket'), default='inprocess')
+    parser.add_argument('--requests', type=int, default=1000, help='Deliveries to send')
+    parser.add_argument('--batch', type=int, default=1, help='Entries per delivery (Meta sends up to 1000)')
+    parser.add_argument('--kind', choices=('mixed',) + KINDS, default='mixed')
+    parser.add_argument('--object', choices=('instagram', 'page'), default='instagram')
+    parser.add_argument('--concurrency', type=int, default=8, help='Client connections in socket mode')
+    parser.add_argument('--server', choices=('gunicorn', 'uvicorn', 'gunicorn-uvicorn'), default='gunicorn')
+    parser.add_argument('--workers', type=int, default=1, help='Server worker processes in socket mode')
+    parser.add_argument('--config', action='append', default=[],
+                        help="Configuration to compare, 'label:KEY=VAL,...' (also workers= and server=)")
+    parser.add_argument('--validation', action='store_true',
+                        help='Measure event validation overhead per 1000 entries instead of the endpoint')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    opts = parser.parse_args(argv)
+
+    if opts.child:
+        print(json.dumps(run_inprocess(opts)))
+        return
+
+    if opts.validation:
+        result = run_validation(opts)
+        if opts.json:
+            print(json.dumps(result, indent=2))
+        else:
+            print('  '.join(f'{key}={value}' for key, value in result.items()))
+        return
+
+    opts.passthrough = ['--requests', str(opts.requests), '--batch', str(opts.batch),
+                        '--kind', opts.kind, '--object', opts.object]
+    configs = [parse_config(spec) for spec in opts.config] or [('default', {}, {})]
+    results = [run_config(opts, label, env, options) for label, env, options in configs]
+
+    if opts.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class DedupIndex:
+    """Memory-bounded set of recently seen keys with a fixed time-to-live.
+
+    Keys are kept in insertion order, which is also expiry order, so expired
+    and over-capacity keys are always popped from the front in O(1).
+    """
+
+    def __init__(self, max_keys=100000, ttl=3600):
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def seen(self, key):
+        """Return True if `key` was already seen within the TTL, otherwise remember it"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if key in self._keys:
+                self.hits += 1
+                return True
+
+            self.misses += 1
+            self._keys[key] = now + self.ttl
+            if len(self._keys) > self.max_keys:
+                self._keys.popitem(last=False)
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._keys),
+                'max_keys': self.max_keys,
+                'ttl': self.ttl,
+            }
+
+    def snapshot(self):
+        """Live keys with their expiry as wall-clock time, for restore() in a later process"""
+        offset = time.time() - time.monotonic()
+        with self._lock:
+            self._expire(time.monotonic())
+            return [(key, expires + offset) for key, expires in self._keys.items()]
+
+    def restore(self, state):
+        """Add keys from a snapshot() that haven't expired ahead of any newer ones"""
+        offset = time.time() - time.monotonic()
+        now = time.monotonic()
+        with self._lock:
+            # Walk newest first so moving each to the front keeps expiry order
+            for key, expires in reversed(state):
+                expires -= offset
+                if expires > now and key not in self._keys:
+                    self._keys[key] = expires
+                    self._keys.move_to_end(key, last=False)
+            while len(self._keys) > self.max_keys:
+                self._keys.popitem(last=False)
+            return len(self._keys)
+
+    def _expire(self, now):
+        while self._keys:
+            key, expires = next(iter(self._keys.items()))
+            if expires > now:
+                break
+            del self._keys[key]
+
+
+def delivery_key(payload):
+    """Digest of a raw delivery body, for catching exact redeliveries before parsing"""
+    return hashlib.blake2b(payload, digest_size=16).digest()
+
+
+def event_key(event):
+    """Stable identity of a normalized event.
+
+    Uses the message mid or comment id when present, otherwise a digest of the
+    item together with the account it belongs to and its event time.
+    """
+    item = event['data']
+    if event['field'] == 'messages':
+        message = item.get('message')
+        if isinstance(message, dict) and message.get('mid'):
+            return f"mid:{message['mid']}"
+    elif event['field'] == 'comments':
+        value = item.get('value')
+        if isinstance(value, dict) and value.get('id'):
+            return f"comment:{value['id']}"
+
+    canonical = json.dumps([event['object'], event['object_id'], event['event_time'], item], sort_keys=True)
+    return 'digest:' + hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
@@ -0,0 +1,257 @@
+import os
+import gzip
+import mmap
+import time
+import zlib
+import struct
+import logging
+import threading
+
+from perprocess import PerProcess
+
+logger = logging.getLogger(__name__)
+
+# Record header: payload length, CRC32 of the payload, receive time, flags
+HEADER = struct.Struct('>IIdB')
+FLAG_SIGNATURE_VALID = 0x01
+
+ACTIVE_SUFFIX = '.log.open'
+SEALED_SUFFIX = '.log'
+COMPRESSED_SUFFIX = '.log.gz'
+
+
+class EventLog:
+    """Append-only, length-prefixed log of raw webhook payloads split into segments.
+
+    append() only writes into a buffered file under a lock; a background thread
+    flushes and fsyncs on an interval, so many records share one fsync. Each
+    process writes its own active segment, which is sealed once it reaches
+    `max_segment_bytes` or `max_segment_age` seconds and optionally gzipped.
+    The lock only covers buffer writes and flushes: fsync and sealing happen
+    in the background thread outside it, so an append never waits on the disk.
+    """
+
+    def __init__(self, directory, max_segment_bytes=64 * 1024 * 1024, max_segment_age=3600,
+                 fsync_interval=0.05, compress=False):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_age = max_segment_age
+        self.fsync_interval = fsync_interval
+        self.compress = compress
+
+        self._lock = threading.Lock()
+        # Serializes sync() and close(), which touch the disk outside _lock
+        self._sync_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._process = PerProcess(self._start_process)
+        self._file = None
+        self._path = None
+        self._opened_at = 0.0
+        self._size = 0
+        self._dirty = False
+
+        self.records = 0
+        self.bytes = 0
+        self.fsyncs = 0
+        self.segments_sealed = 0
+
+    def append(self, payload, signature_valid):
+        """Buffer one record; it is durable after the next periodic fsync"""
+        header = HEADER.pack(len(payload), zlib.crc32(payload), time.time(),
+                             FLAG_SIGNATURE_VALID if signature_valid else 0)
+        with self._lock:
+            self._ensure_open()
+            self._file.write(header)
+            self._file.write(payload)
+            self._size += HEADER.size + len(payload)
+            self._dirty = True
+            self.records += 1
+            self.bytes += HEADER.size + len(payload)
+            full = self._size >= self.max_segment_bytes
+
+        if full:
+            # Sealed by the flusher thread
+            self._wakeup.set()
+
+    def sync(self):
+        """Flush and fsync the active segment, sealing it if it is too big or too old"""
+        with self._sync_lock:
+            with self._lock:
+                if self._file is None:
+                    return
+                file = self._file
+                dirty = self._dirty
+                if dirty:
+                    file.flush()
+                    self._dirty = False
+                if self._size >= self.max_segment_bytes or time.time() - self._opened_at >= self.max_segment_age:
+                    sealing = self._detach()
+                else:
+                    sealing = None
+
+            if sealing is not None:
+                self._seal(*sealing)
+            elif dirty:
+                os.fsync(file.fileno())
+                self.fsyncs += 1
+
+    def close(self):
+        """Make everything durable and seal the active segment"""
+        with self._sync_lock:
+            with self._lock:
+                sealing = self._detach() if self._file is not None else None
+            if sealing is not None:
+                self._seal(*sealing)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'directory': self.directory,
+                'records': self.records,
+                'bytes': self.bytes,
+                'fsyncs': self.fsyncs,
+                'segments_sealed': self.segments_sealed,
+                'active_segment': os.path.basename(self._path) if self._path else None,
+                'active_segment_bytes': self._size,
+            }
+
+    def _ensure_open(self):
+        # Called with the lock held. Each process gets its own segment and flusher
+        self._process.ensure()
+        if self._file is None:
+            name = f'segment-{time.time_ns():020d}-{os.getpid()}{ACTIVE_SUFFIX}'
+            self._path = os.path.join(self.directory, name)
+            self._file = open(self._path, 'ab', buffering=1024 * 1024)
+            self._opened_at = time.time()
+            self._size = 0
+
+    def _start_process(self):
+        if self._file is not None:
+            # Inherited across fork: drop the parent's buffered writes instead
+            # of flushing them into its segment a second time
+            os.close(self._file.fileno())
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+        os.makedirs(self.directory, exist_ok=True)
+        threading.Thread(target=self._flush_loop, name='event-log-flush', daemon=True).start()
+
+    def _detach(self):
+        # Called with the lock held. The next append opens a new segment
+        sealing = (self._file, self._path)
+        self._file = None
+        self._path = None
+        self._size = 0
+        self._dirty = False
+        return sealing
+
+    def _seal(self, file, path):
+        # Called without the lock: nothing else holds a detached segment
+        file.flush()
+        os.fsync(file.fileno())
+        file.close()
+
+        sealed = path[:-len(ACTIVE_SUFFIX)] + SEALED_SUFFIX
+        os.replace(path, sealed)
+        self.fsyncs += 1
+        self.segments_sealed += 1
+
+        if self.compress:
+            threading.Thread(target=compress_segment, args=(sealed,), daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            self._wakeup.wait(self.fsync_interval)
+            self._wakeup.clear()
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error(f"Event log fsync failed: {str(e)}")
+
+
+def compress_segment(path):
+    """Gzip a sealed segment and remove the original"""
+    try:
+        with open(path, 'rb') as src, gzip.open(path + '.gz.tmp', 'wb') as dst:
+            while True:
+                chunk = src.read(1024 * 1024)
+                if not chunk:
+                    break
+                dst.write(chunk)
+        os.replace(path + '.gz.tmp', path[:-len(SEALED_SUFFIX)] + COMPRESSED_SUFFIX)
+        os.remove(path)
+    except OSError as e:
+        logger.error(f"Failed to compress event log segment {path}: {str(e)}")
+
+
+def list_segments(directory):
+    """Segment paths in the order they were opened, sealed and active alike"""
+    suffixes = (ACTIVE_SUFFIX, SEALED_SUFFIX, COMPRESSED_SUFFIX)
+    names = sorted(n for n in os.listdir(directory) if n.startswith('segment-') and n.endswith(suffixes))
+    return [os.path.join(directory, n) for n in names]
+
+
+def _iter_buffer(buf, path):
+    offset = 0
+    while offset + HEADER.size <= len(buf):
+        length, crc, received_at, flags = HEADER.unpack_from(buf, offset)
+        start = offset + HEADER.size
+        payload = bytes(buf[start:start + length])
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            # A crash can leave a torn record at the tail of the active segment
+            logger.warning(f"Stopping at corrupt or truncated record in {path} at offset {offset}")
+            return
+        yield received_at, bool(flags & FLAG_SIGNATURE_VALID), payload
+        offset = start + length
+
+
+def iter_segment(path):
+    """Yield (received_at, signature_valid, payload) from one segment.
+
+    Uncompressed segments are memory-mapped so only the pages being read are
+    resident; gzipped segments are streamed record by record.
+    """
+    if path.endswith(COMPRESSED_SUFFIX):
+        with gzip.open(path, 'rb') as f:
+            while True:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    return
+                length, crc, received_at, flags = HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    logger.warning(f"Stopping at corrupt or truncated record in {path}")
+                    return
+                yield received_at, bool(flags & FLAG_SIGNATURE_VALID), payload
+        return
+
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            view = memoryview(buf)
+            try:
+                yield from _iter_buffer(view, path)
+            finally:
+                view.release()
+
+
+def replay(directory, handler, rate=0):
+    """Feed every logged payload to handler(payload, signature_valid).
+
+    `rate` limits replay to that many records per second (0 = unlimited).
+    Returns the number of records replayed.
+    """
+    count = 0
+    started = time.monotonic()
+    for path in list_segments(directory):
+        for received_at, signature_valid, payload in iter_segment(path):
+            if rate:
+                delay = started + count / rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            handler(payload, signature_valid)
+            count += 1
+    return count
@@ -0,0 +1,479 @@
+import os
+import sys
+import json
+import time
+import bisect
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+
+
+# Fields of normalized events that can be searched by exact value
+INDEXED_FIELDS = ('object', 'field', 'object_id', 'sender', 'media_id')
+TIME_BUCKET_SECONDS = 60
+
+
+class MemoryEventStore:
+    """Per-process event store backed by an OrderedDict keyed by seq.
+
+    Appends, evictions and lookups by seq are O(1). Secondary indexes map each
+    indexed value (and each minute of arrival) to a deque of seqs in arrival
+    order; since eviction always removes the oldest event, its seq is at the
+    front of every deque it appears in. Not shared between gunicorn workers.
+    """
+
+    backend = 'memory'
+
+    def __init__(self, max_events=50, max_age=0):
+        self.max_events = max_events
+        self.max_age = max_age
+        self._events = OrderedDict()
+        self._indexes = {name: {} for name in INDEXED_FIELDS}
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._next_seq = 1
+
+    def append(self, record):
+        """Store a record and return its sequence number"""
+        return self.extend([record])
+
+    def extend(self, records):
+        """Store several records at once and return the last sequence number"""
+        now = time.time()
+        with self._lock:
+            for record in records:
+                seq = self._next_seq
+                self._next_seq += 1
+                self._add(seq, self._pack(record, seq, now))
+            self._evict(now)
+            return self._next_seq - 1
+
+    def recent(self, limit=20, before=None):
+        """Newest records first, optionally only those older than seq `before`"""
+        with self._lock:
+            self._evict(time.time())
+            if not self._events:
+                return []
+            first = next(iter(self._events))
+            end = self._next_seq if before is None else min(before, self._next_seq)
+            return [self._unpack(self._events[seq]) for seq in range(end - 1, max(end - limit, first) - 1, -1)]
+
+    def since(self, seq, limit=100):
+        """Oldest-first records with a sequence number greater than `seq`"""
+        with self._lock:
+            self._evict(time.time())
+            if not self._events:
+                return []
+            start = max(seq + 1, next(iter(self._events)))
+            end = min(self._next_seq, start + limit)
+            return [self._unpack(self._events[s]) for s in range(start, end)]
+
+    def search(self, filters, since=None, until=None, before=None, limit=50):
+        """Newest-first records matching every `filters` value and arrival time range.
+
+        Walks the smallest matching index (or the time buckets in range), so the
+        cost follows the size of that index rather than the whole store. With
+        `before` the walk starts at that seq instead of skipping down to it.
+        """
+        with self._lock:
+            self._evict(time.time())
+            if not self._events:
+                return []
+            first = next(iter(self._events))
+            if before is not None and before <= first:
+                return []
+            # Newest seq that can match
+            end = self._next_seq - 1 if before is None else min(before, self._next_seq) - 1
+
+            candidates = []
+            for name, value in filters.items():
+                seqs = self._indexes[name].get(value)
+                if not seqs:
+                    return []
+                candidates.append(seqs)
+
+            if candidates:
+                source = _newest_first(min(candidates, key=len), end)
+            elif since is not None or until is not None:
+                newest = int(self._events[end]['received_at'] // TIME_BUCKET_SECONDS)
+                oldest = min(self._buckets)
+                high = newest if until is None else min(newest, int(until // TIME_BUCKET_SECONDS))
+                low = oldest if since is None else max(oldest, int(since // TIME_BUCKET_SECONDS))
+                source = (seq for b in range(high, low - 1, -1) for seq in _newest_first(self._buckets.get(b, ()), end))
+            else:
+                source = range(end, first - 1, -1)
+
+            results = []
+            for seq in source:
+                record = self._events[seq]
+                if since is not None and record['received_at'] < since:
+                    # Seqs are walked newest first, nothing older can match
+                    break
+                if until is not None and record['received_at'] > until:
+                    continue
+                if all(record.get(name) == value for name, value in filters.items()):
+                    results.append(self._unpack(record))
+                    if len(results) >= limit:
+                        break
+            return results
+
+    def count(self):
+        with self._lock:
+            self._evict(time.time())
+            return len(self._events)
+
+    def last_seq(self):
+        return self._next_seq - 1
+
+    def stats(self):
+        with self._lock:
+            index_keys = {name: len(index) for name, index in self._indexes.items()}
+        return {
+            'backend': self.backend,
+            'count': self.count(),
+            'last_seq': self.last_seq(),
+            'max_events': self.max_events,
+            'max_age': self.max_age,
+            'index_keys': index_keys,
+        }
+
+    def snapshot(self):
+        """Stored records oldest first, for restore() in a later process"""
+        with self._lock:
+            return {'next_seq': self._next_seq, 'records': [self._unpack(stored) for stored in self._events.values()]}
+
+    def restore(self, state):
+        """Load a snapshot() taken by a previous process into an empty store"""
+        with self._lock:
+            if self._events:
+                return 0
+            for record in state['records']:
+                self._add(record['seq'], self._pack(record, record['seq'], record['received_at']))
+            self._next_seq = max(self._next_seq, state['next_seq'])
+            self._evict(time.time())
+            return len(self._events)
+
+    def _add(self, seq, stored):
+        self._events[seq] = stored
+        for name, index in self._indexes.items():
+            value = stored.get(name)
+            if value is not None:
+                index.setdefault(value, deque()).append(seq)
+        self._buckets.setdefault(int(stored['received_at'] // TIME_BUCKET_SECONDS), deque()).append(seq)
+
+    def _pack(self, record, seq, now):
+        return dict(record, seq=seq, received_at=now)
+
+    def _unpack(self, stored):
+        return stored
+
+    def _over_budget(self):
+        return len(self._events) > self.max_events
+
+    def _evict(self, now):
+        cutoff = now - self.max_age if self.max_age else None
+        while self._events:
+            seq, record = next(iter(self._events.items()))
+            if not self._over_budget() and (cutoff is None or record['received_at'] >= cutoff):
+                break
+            self._remove_oldest(seq, record)
+
+    def _remove_oldest(self, seq, record):
+        del self._events[seq]
+        for name, index in self._indexes.items():
+            value = record.get(name)
+            if value is not None:
+                self._unindex(index, value)
+        self._unindex(self._buckets, int(record['received_at'] // TIME_BUCKET_SECONDS))
+
+    @staticmethod
+    def _unindex(index, key):
+        seqs = index[key]
+        seqs.popleft()
+        if not seqs:
+            del index[key]
+
+
+def _newest_first(seqs, end):
+    """Seqs of an ascending deque up to `end`, newest first"""
+    if not seqs or seqs[-1] <= end:
+        return reversed(seqs)
+    # Indexing a deque is cheap near either end, which is where paging starts
+    return (seqs[i] for i in range(bisect.bisect_right(seqs, end) - 1, -1, -1))
+
+
+class CompactEvent:
+    """Stored event as raw JSON bytes plus a small fixed header.
+
+    Indexed values are interned strings shared between events, the type label
+    is a code into the store's type table, and `raw` is only parsed when the
+    event is viewed.
+    """
+
+    __slots__ = ('seq', 'received_at', 'type_code', 'verified', 'object', 'field',
+                 'object_id', 'sender', 'media_id', 'event_time', 'raw')
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class CompactEventStore(MemoryEventStore):
+    """Memory store that keeps each event as a CompactEvent, retained by byte budget.
+
+    Uses a fraction of the memory of parsed dicts, so far more events fit in
+    the same RSS. `max_bytes` bounds the total size of stored events, on top
+    of the `max_events` and `max_age` limits.
+    """
+
+    backend = 'compact'
+
+    def __init__(self, max_events=50, max_age=0, max_bytes=0, dumps=None, loads=None):
+        super().__init__(max_events=max_events, max_age=max_age)
+        self.max_bytes = max_bytes
+        self._dumps = dumps or (lambda data: json.dumps(data, separators=(',', ':')).encode('utf-8'))
+        self._loads = loads or json.loads
+        self._types = []
+        self._type_codes = {}
+        self._bytes = 0
+
+    def stats(self):
+        stats = super().stats()
+        stats.update(bytes=self._bytes, max_bytes=self.max_bytes, types=len(self._types))
+        return stats
+
+    def _pack(self, record, seq, now):
+        event = CompactEvent()
+        event.seq = seq
+        event.received_at = now
+        event.type_code = self._type_codes.get(record['type'])
+        if event.type_code is None:
+            event.type_code = self._type_codes[record['type']] = len(self._types)
+            self._types.append(record['type'])
+        event.verified = record['signature_status'] == 'verified'
+        for name in INDEXED_FIELDS:
+            setattr(event, name, _intern(record.get(name)))
+        event.event_time = record.get('event_time')
+        # Copied so the buffer is exactly sized; orjson over-allocates its output
+        event.raw = bytes(memoryview(self._dumps(record['data'])))
+        self._bytes += self._sizeof(event)
+        return event
+
+    def _unpack(self, event):
+        record = {
+            'seq': event.seq,
+            'received_at': event.received_at,
+            'timestamp': datetime.utcfromtimestamp(event.received_at).strftime('%Y-%m-%d %H:%M:%S UTC'),
+            'type': self._types[event.type_code],
+            'signature_status': 'verified' if event.verified else 'unverified',
+            'event_time': event.event_time,
+            'data': self._loads(event.raw),
+        }
+        for name in INDEXED_FIELDS:
+            record[name] = getattr(event, name)
+        return record
+
+    def _over_budget(self):
+        return super()._over_budget() or (self.max_bytes and self._bytes > self.max_bytes)
+
+    def _remove_oldest(self, seq, record):
+        super()._remove_oldest(seq, record)
+        self._bytes -= self._sizeof(record)
+
+    @staticmethod
+    def _sizeof(event):
+        # Indexed strings are interned and shared, so only the header and payload count
+        return sys.getsizeof(event) + sys.getsizeof(event.raw)
+
+
+# Optional per-event columns, filled from normalized events when present
+EVENT_COLUMNS = ('object', 'field', 'object_id', 'sender', 'media_id', 'event_time')
+
+
+class SQLiteEventStore:
+    """Event store in a SQLite database in WAL mode, shared by all worker processes.
+
+    Rows are keyed by an autoincrement seq and only ever deleted from the oldest
+    end, so the live range is contiguous and counts and pages are primary-key
+    range lookups rather than table scans.
+    """
+
+    backend = 'sqlite'
+
+    def __init__(self, path, max_events=50, max_age=0, prune_interval=100):
+        self.path = path
+        self.max_events = max_events
+        self.max_age = max_age
+        self.prune_interval = prune_interval
+        self._local = threading.local()
+        self._appends = 0
+
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                received_at REAL NOT NULL,
+                timestamp TEXT NOT NULL,
+                type TEXT NOT NULL,
+                signature_status TEXT NOT NULL,
+                data TEXT NOT NULL
+            )
+        """)
+        # Databases created before a column was added are upgraded in place
+        existing = {row['name'] for row in conn.execute("PRAGMA table_info(events)")}
+        for column in EVENT_COLUMNS:
+            if column not in existing:
+                conn.execute(f"ALTER TABLE events ADD COLUMN {column}")
+        conn.execute("CREATE INDEX IF NOT EXISTS events_received_at ON events (received_at)")
+        for column in INDEXED_FIELDS:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS events_{column} ON events ({column}, seq)")
+
+    def append(self, record):
+        """Store a record and return its sequence number"""
+        return self.extend([record])
+
+    def extend(self, records):
+        """Store several records in one transaction and return the last sequence number"""
+        now = time.time()
+        columns = ('received_at', 'timestamp', 'type', 'signature_status', 'data') + EVENT_COLUMNS
+        sql = f"INSERT INTO events ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+        conn = self._conn()
+        with conn:
+            seq = None
+            for record in records:
+                cursor = conn.execute(sql, (
+                    now, record['timestamp'], record['type'], record['signature_status'],
+                    json.dumps(record['data'])
+                ) + tuple(record.get(column) for column in EVENT_COLUMNS))
+                seq = cursor.lastrowid
+
+        # Prune in batches so the common append is a single insert
+        before = self._appends // self.prune_interval
+        self._appends += len(records)
+        if seq is not None and self._appends // self.prune_interval != before:
+            self._evict(seq, now)
+        return seq
+
+    def recent(self, limit=20, before=None):
+        """Newest records first, optionally only those older than seq `before`"""
+        where, params = self._live_filter()
+        if before is not None:
+            where += " AND seq < ?"
+            params.append(before)
+        rows = self._conn().execute(
+            f"SELECT * FROM events WHERE {where} ORDER BY seq DESC LIMIT ?", params + [limit]
+        )
+        return [self._record(row) for row in rows]
+
+    def since(self, seq, limit=100):
+        """Oldest-first records with a sequence number greater than `seq`"""
+        where, params = self._live_filter()
+        rows = self._conn().execute(
+            f"SELECT * FROM events WHERE {where} AND seq > ? ORDER BY seq LIMIT ?",
+            params + [seq, limit]
+        )
+        return [self._record(row) for row in rows]
+
+    def search(self, filters, since=None, until=None, before=None, limit=50):
+        """Newest-first records matching every `filters` value and arrival time range"""
+        where, params = self._live_filter()
+        for name, value in filters.items():
+            if name not in INDEXED_FIELDS:
+                raise ValueError(f"Not an indexed field: {name}")
+            where += f" AND {name} = ?"
+            params.append(value)
+        if since is not None:
+            where += " AND received_at >= ?"
+            params.append(since)
+        if until is not None:
+            where += " AND received_at <= ?"
+            params.append(until)
+        if before is not None:
+            where += " AND seq < ?"
+            params.append(before)
+        rows = self._conn().execute(
+            f"SELECT * FROM events WHERE {where} ORDER BY seq DESC LIMIT ?", params + [limit]
+        )
+        return [self._record(row) for row in rows]
+
+    def count(self):
+        where, params = self._live_filter()
+        low, high = self._conn().execute(
+            f"SELECT MIN(seq), MAX(seq) FROM events WHERE {where}", params
+        ).fetchone()
+        return high - low + 1 if low is not None else 0
+
+    def last_seq(self):
+        row = self._conn().execute("SELECT MAX(seq) FROM events").fetchone()
+        return row[0] or 0
+
+    def snapshot(self):
+        # Already durable on disk
+        return None
+
+    def restore(self, state):
+        return 0
+
+    def stats(self):
+        return {
+            'backend': self.backend,
+            'path': self.path,
+            'count': self.count(),
+            'last_seq': self.last_seq(),
+            'max_events': self.max_events,
+            'max_age': self.max_age,
+        }
+
+    def _live_filter(self):
+        # Rows past the limits may linger until the next prune; hide them from reads
+        where, params = "seq > ?", [self.last_seq() - self.max_events]
+        if self.max_age:
+            where += " AND received_at >= ?"
+            params.append(time.time() - self.max_age)
+        return where, params
+
+    def _evict(self, last_seq, now):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM events WHERE seq <= ?", (last_seq - self.max_events,))
+            if self.max_age:
+                conn.execute("DELETE FROM events WHERE received_at < ?", (now - self.max_age,))
+
+    def _conn(self):
+        # sqlite3 connections can't cross threads or forks, so keep one per thread per process
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _record(row):
+        record = dict(row)
+        record['data'] = json.loads(record['data'])
+        return record
+
+
+def create_event_store(backend='memory', path=None, max_events=50, max_age=0, max_bytes=0,
+                       dumps=None, loads=None):
+    """Build the configured event store backend"""
+    if backend == 'memory':
+        return MemoryEventStore(max_events=max_events, max_age=max_age)
+    if backend == 'compact':
+        return CompactEventStore(max_events=max_events, max_age=max_age, max_bytes=max_bytes,
+                                 dumps=dumps, loads=loads)
+    if backend == 'sqlite':
+        return SQLiteEventStore(path, max_events=max_events, max_age=max_age)
+    raise ValueError(f"Unknown event store backend: {backend}")
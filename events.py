@@ -0,0 +1,233 @@
+import json
+import threading
+
+from models import Change, Message, epoch_seconds, model_for, validate_entry
+
+OBJECT_LABELS = {
+    'instagram': 'Instagram',
+    'page': 'Facebook Page',
+}
+
+# Webhook fields reported as metric labels per object; anything else in a
+# payload (which may not even be signed) is counted as 'other'
+METRIC_FIELDS = {
+    'instagram': frozenset((
+        '', 'messages', 'messaging_postbacks', 'messaging_seen', 'messaging_referral', 'messaging_optins',
+        'message_reactions', 'message_edit', 'comments', 'live_comments', 'mentions', 'story_insights',
+    )),
+    'page': frozenset((
+        '', 'messages', 'messaging_postbacks', 'messaging_optins', 'messaging_referrals', 'message_deliveries',
+        'message_reads', 'message_reactions', 'feed', 'mention', 'ratings', 'videos', 'live_videos', 'leadgen',
+    )),
+}
+
+# Upper bounds of the batch size histogram buckets (events per delivery)
+BATCH_SIZE_BUCKETS = (1, 10, 100, 1000)
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = json.decoder.WHITESPACE
+
+
+def describe(obj, field):
+    """Human readable event type, e.g. 'Instagram - Comments'"""
+    label = OBJECT_LABELS.get(obj, 'Unknown')
+    if field:
+        label += f' - {field.title()}'
+    return label
+
+
+def metric_labels(obj, field):
+    """(object, field) metric labels with unknown values folded into 'other'"""
+    fields = METRIC_FIELDS.get(obj) if isinstance(obj, str) else None
+    if fields is None:
+        return 'other', 'other'
+    return obj, field if isinstance(field, str) and field in fields else 'other'
+
+
+def iter_entry_events(obj, entries, fallback=None, on_invalid=None, validate=True):
+    """Yield one normalized event per change/messaging item across `entries`.
+
+    A delivery can batch many entries, each with many items. Every event has
+    the object type, field, object id (the page or IG account in entry.id),
+    event time, sender id, media id and the raw item. `entries` may be any
+    iterable, so a streamed delivery is consumed one entry at a time. If no
+    entry has any items, `fallback()` supplies the data for a single event
+    carrying the whole payload so the delivery is still recorded; it may
+    return None to record nothing.
+
+    Entries and items are checked against their model's schema first, and
+    ones that fail are passed to `on_invalid(level, reason, field, object_id,
+    data)` instead of being yielded. `validate=False` skips the checks for
+    benchmarking them.
+    """
+    found = False
+
+    for entry in entries:
+        reason = validate_entry(entry) if validate else None
+        if reason is not None:
+            # Quarantined, so the delivery isn't also recorded whole
+            found = True
+            if on_invalid is not None:
+                on_invalid('entry', f'entry {reason}', None, _entry_id(entry), entry)
+            continue
+        object_id = str(entry['id']) if 'id' in entry else None
+        entry_time = epoch_seconds(entry.get('time'))
+
+        for item in entry.get('messaging') or ():
+            found = True
+            reason = Message.validate(item) if validate else None
+            if reason is not None:
+                if on_invalid is not None:
+                    on_invalid('item', f'Message {reason}', 'messages', object_id, item)
+                continue
+            yield Message(obj, 'messages', object_id, entry_time, item).as_record()
+
+        for item in entry.get('changes') or ():
+            found = True
+            field = item.get('field') if isinstance(item, dict) else None
+            model = model_for(obj, field) if isinstance(field, str) else Change
+            reason = model.validate(item) if validate else None
+            if reason is not None:
+                if on_invalid is not None:
+                    on_invalid('item', f'{model.__name__} {reason}', field if isinstance(field, str) else None, object_id, item)
+                continue
+            yield model(obj, field, object_id, entry_time, item).as_record()
+
+    data = fallback() if not found and fallback is not None else None
+    if data is not None:
+        yield {
+            'object': obj,
+            'field': '',
+            'object_id': None,
+            'event_time': None,
+            'sender': None,
+            'media_id': None,
+            'data': data,
+        }
+
+
+def _entry_id(entry):
+    return str(entry['id']) if isinstance(entry, dict) and isinstance(entry.get('id'), (str, int)) else None
+
+
+def split_delivery(data):
+    """(object, entry list) of a parsed delivery"""
+    obj = data.get('object') if isinstance(data, dict) else None
+    entries = data.get('entry') if isinstance(data, dict) else None
+    return obj, entries if isinstance(entries, list) else ()
+
+
+def _skip_whitespace(text, pos):
+    return _WHITESPACE.match(text, pos).end()
+
+
+def _iter_array(text, pos):
+    # Decode one array element at a time, starting at the '['
+    if not text.startswith('[', pos):
+        return
+    pos = _skip_whitespace(text, pos + 1)
+    if text.startswith(']', pos):
+        return
+    while True:
+        item, pos = _decoder.raw_decode(text, pos)
+        yield item
+        pos = _skip_whitespace(text, pos)
+        if text.startswith(']', pos):
+            return
+        if not text.startswith(',', pos):
+            raise ValueError(f"Expected ',' or ']' at position {pos}")
+        pos = _skip_whitespace(text, pos + 1)
+
+
+def stream_delivery(payload):
+    """(object, entry iterator) for a raw delivery, decoding one entry at a time.
+
+    Only the top-level members ahead of "entry" are decoded up front; entries
+    are decoded as the iterator is consumed, so the whole parsed tree is never
+    held at once. Meta sends "object" first; a delivery with "entry" ahead of
+    it, or a body that isn't a JSON object, falls back to a full parse.
+    """
+    text = payload.decode('utf-8') if isinstance(payload, (bytes, bytearray)) else payload
+    pos = _skip_whitespace(text, 0)
+    if not text.startswith('{', pos):
+        return split_delivery(json.loads(text))
+
+    obj = None
+    seen_object = False
+    pos = _skip_whitespace(text, pos + 1)
+    while not text.startswith('}', pos):
+        key, pos = _decoder.raw_decode(text, pos)
+        pos = _skip_whitespace(text, pos)
+        if not text.startswith(':', pos):
+            raise ValueError(f"Expected ':' at position {pos}")
+        pos = _skip_whitespace(text, pos + 1)
+
+        if key == 'entry':
+            if not seen_object:
+                return split_delivery(json.loads(text))
+            return obj, _iter_array(text, pos)
+
+        value, pos = _decoder.raw_decode(text, pos)
+        if key == 'object':
+            obj, seen_object = value, True
+        pos = _skip_whitespace(text, pos)
+        if text.startswith(',', pos):
+            pos = _skip_whitespace(text, pos + 1)
+
+    return obj, ()
+
+
+class BatchStats:
+    """Counts deliveries and events so throughput reflects events, not requests"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.deliveries = 0
+        self.events = 0
+        self.max_batch = 0
+        self.last_batch = 0
+        self.histogram = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+
+    def record(self, size):
+        bucket = len(BATCH_SIZE_BUCKETS)
+        for i, bound in enumerate(BATCH_SIZE_BUCKETS):
+            if size <= bound:
+                bucket = i
+                break
+
+        with self._lock:
+            self.deliveries += 1
+            self.events += size
+            self.last_batch = size
+            self.max_batch = max(self.max_batch, size)
+            self.histogram[bucket] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'deliveries': self.deliveries,
+                'events': self.events,
+                'max_batch': self.max_batch,
+                'histogram': list(self.histogram),
+            }
+
+    def restore(self, state):
+        """Add totals carried over from a previous process"""
+        with self._lock:
+            self.deliveries += state['deliveries']
+            self.events += state['events']
+            self.max_batch = max(self.max_batch, state['max_batch'])
+            self.histogram = [a + b for a, b in zip(self.histogram, state['histogram'])]
+            return self.deliveries
+
+    def stats(self):
+        with self._lock:
+            labels = [f'<={bound}' for bound in BATCH_SIZE_BUCKETS] + [f'>{BATCH_SIZE_BUCKETS[-1]}']
+            return {
+                'deliveries': self.deliveries,
+                'events': self.events,
+                'avg_batch': round(self.events / self.deliveries, 2) if self.deliveries else 0.0,
+                'max_batch': self.max_batch,
+                'last_batch': self.last_batch,
+                'batch_sizes': dict(zip(labels, self.histogram)),
+            }
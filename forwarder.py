@@ -0,0 +1,291 @@
+import os
+import json
+import time
+import queue
+import socket
+import logging
+import threading
+import http.client
+from collections import deque
+from urllib.parse import urlsplit
+
+from perprocess import PerProcess
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryError(Exception):
+    """A sink failed to accept a batch; `retry` says whether trying again may help"""
+
+    def __init__(self, message, retry=True):
+        super().__init__(message)
+        self.retry = retry
+
+
+class HTTPSink:
+    """POSTs batches as newline-delimited JSON over keep-alive connections"""
+
+    def __init__(self, url, timeout=10.0):
+        self.name = url
+        self.url = urlsplit(url)
+        self.timeout = timeout
+        self._pool = queue.LifoQueue()
+
+    def send(self, body):
+        conn = self._checkout()
+        try:
+            conn.request('POST', self.url.path or '/', body=body,
+                         headers={'Content-Type': 'application/x-ndjson'})
+            response = conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            raise DeliveryError(f"{type(e).__name__}: {e}")
+
+        # Connection is reusable once the response has been read
+        self._pool.put(conn)
+        if response.status >= 300:
+            retry = response.status >= 500 or response.status in (408, 429)
+            raise DeliveryError(f"HTTP {response.status}", retry=retry)
+
+    def _checkout(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            cls = http.client.HTTPSConnection if self.url.scheme == 'https' else http.client.HTTPConnection
+            return cls(self.url.hostname, self.url.port, timeout=self.timeout)
+
+
+class UnixSocketSink:
+    """Streams newline-delimited JSON to a local Unix domain socket"""
+
+    def __init__(self, path, timeout=10.0):
+        self.name = f'unix://{path}'
+        self.path = path
+        self.timeout = timeout
+        self._sock = None
+        self._lock = threading.Lock()
+
+    def send(self, body):
+        with self._lock:
+            try:
+                if self._sock is None:
+                    self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    self._sock.settimeout(self.timeout)
+                    self._sock.connect(self.path)
+                self._sock.sendall(body)
+            except OSError as e:
+                if self._sock is not None:
+                    self._sock.close()
+                    self._sock = None
+                raise DeliveryError(str(e))
+
+
+class FileSink:
+    """Appends newline-delimited JSON to a file"""
+
+    def __init__(self, path):
+        self.name = f'file://{path}'
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send(self, body):
+        with self._lock:
+            try:
+                with open(self.path, 'ab') as f:
+                    f.write(body)
+            except OSError as e:
+                raise DeliveryError(str(e))
+
+
+def create_sink(uri):
+    """Sink for an http(s)://, unix:// or file:// URI"""
+    scheme = uri.split('://', 1)[0]
+    if scheme in ('http', 'https'):
+        return HTTPSink(uri)
+    if scheme == 'unix':
+        return UnixSocketSink(uri[len('unix://'):])
+    if scheme == 'file':
+        return FileSink(uri[len('file://'):])
+    raise ValueError(f"Unsupported sink: {uri}")
+
+
+class SinkWorker:
+    """Batches events for one sink and delivers them from background threads"""
+
+    def __init__(self, sink, batch_size, batch_timeout, max_retries, queue_size, dead_letter_dir, senders):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.max_retries = max_retries
+        self.dead_letter_dir = dead_letter_dir
+        self.senders = senders
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._recent = deque()
+        # Sender thread id -> the batch it has taken off the queue and not yet settled
+        self._in_flight = {}
+        self._stopping = threading.Event()
+
+        self.sent_events = 0
+        self.sent_batches = 0
+        self.retries = 0
+        self.dead_lettered = 0
+        self.last_lag = 0.0
+
+    def start(self):
+        for i in range(self.senders):
+            threading.Thread(target=self._run, name=f'forward-{i}', daemon=True).start()
+
+    def submit(self, lines):
+        """Queue serialized events without blocking, spooling whatever doesn't fit in one write"""
+        now = time.time()
+        overflow = []
+        for line in lines:
+            try:
+                self._queue.put_nowait((now, line))
+            except queue.Full:
+                overflow.append(line)
+        if overflow:
+            self._dead_letter(overflow, 'queue full')
+
+    def drain(self, deadline):
+        """Give queued and in-flight events until `deadline` (monotonic) to go out, then dead-letter the rest"""
+        while (not self._queue.empty() or self._in_flight) and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        # Cut retry backoff short; senders dead-letter the batches they hold
+        self._stopping.set()
+        grace = time.monotonic() + 1.0
+        while self._in_flight and time.monotonic() < grace:
+            time.sleep(0.05)
+
+        leftover = []
+        while True:
+            try:
+                leftover.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        # Senders still blocked in a send; if it succeeds after all the events are
+        # delivered twice, which beats losing them
+        with self._lock:
+            for batch in self._in_flight.values():
+                leftover.extend(batch)
+            self._in_flight.clear()
+        if leftover:
+            self._dead_letter([line for _, line in leftover], 'shutdown')
+
+    def stats(self):
+        now = time.time()
+        with self._queue.mutex:
+            oldest = self._queue.queue[0][0] if self._queue.queue else None
+        with self._lock:
+            while self._recent and self._recent[0][0] < now - 60:
+                self._recent.popleft()
+            return {
+                'pending': self._queue.qsize(),
+                'sent_events': self.sent_events,
+                'sent_batches': self.sent_batches,
+                'retries': self.retries,
+                'dead_lettered': self.dead_lettered,
+                'events_per_second': round(sum(n for _, n in self._recent) / 60, 2),
+                'lag_seconds': round(now - oldest, 3) if oldest else 0.0,
+                'last_delivery_lag_seconds': round(self.last_lag, 3),
+            }
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        with self._lock:
+            self._in_flight[threading.get_ident()] = batch
+        deadline = time.monotonic() + self.batch_timeout
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            delivered = self._deliver(b''.join(line for _, line in batch))
+            with self._lock:
+                # Not ours any more if drain() dead-lettered it
+                owned = self._in_flight.pop(threading.get_ident(), None) is not None
+            if not delivered:
+                if owned:
+                    self._dead_letter([line for _, line in batch], 'delivery failed')
+                continue
+
+            now = time.time()
+            with self._lock:
+                self.sent_events += len(batch)
+                self.sent_batches += 1
+                self.last_lag = now - batch[0][0]
+                self._recent.append((now, len(batch)))
+
+    def _deliver(self, body):
+        """Send with exponential backoff, returns False once retries are exhausted"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.sink.send(body)
+                return True
+            except DeliveryError as e:
+                logger.warning(f"Forwarding to {self.sink.name} failed: {str(e)}")
+                if not e.retry or self._stopping.is_set():
+                    return False
+            if attempt < self.max_retries:
+                with self._lock:
+                    self.retries += 1
+                if self._stopping.wait(min(30.0, 0.5 * 2 ** attempt)):
+                    return False
+        return False
+
+    def _dead_letter(self, lines, reason):
+        logger.error(f"Forwarding to {self.sink.name} failed ({reason}), spooling {len(lines)} event(s)")
+        with self._lock:
+            self.dead_lettered += len(lines)
+        try:
+            os.makedirs(self.dead_letter_dir, exist_ok=True)
+            safe_name = ''.join(c if c.isalnum() else '_' for c in self.sink.name)
+            path = os.path.join(self.dead_letter_dir, f'{safe_name}-{os.getpid()}.ndjson')
+            with open(path, 'ab') as f:
+                f.write(b''.join(lines))
+        except OSError as e:
+            logger.error(f"Failed to write dead-letter spool: {str(e)}")
+
+
+class Forwarder:
+    """Fans stored events out to every configured sink, off the request path"""
+
+    def __init__(self, uris, batch_size=100, batch_timeout=1.0, max_retries=5,
+                 queue_size=10000, dead_letter_dir='/tmp/webhook-dead-letter', senders=2):
+        self.workers = [
+            SinkWorker(create_sink(uri), batch_size, batch_timeout, max_retries,
+                       queue_size, dead_letter_dir, senders)
+            for uri in uris
+        ]
+        self._started = PerProcess(self._start)
+
+    def submit(self, records):
+        """Serialize each record once and queue it for every sink"""
+        self._started.ensure()
+        lines = [json.dumps(record, default=str).encode('utf-8') + b'\n' for record in records]
+        for worker in self.workers:
+            worker.submit(lines)
+
+    def _start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def drain(self, timeout):
+        """Flush pending events within `timeout` seconds, spooling what doesn't make it"""
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            worker.drain(deadline)
+
+    def stats(self):
+        return {worker.sink.name: worker.stats() for worker in self.workers}
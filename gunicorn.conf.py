@@ -0,0 +1,29 @@
+import os
+import sys
+import shutil
+
+
+def on_starting(server):
+    """Clear metrics left behind by workers of a previous run"""
+    metrics_dir = os.environ.get('METRICS_DIR')
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+def post_worker_init(worker):
+    """Restore this worker's state snapshot (the app has been imported by now)"""
+    receiver = sys.modules.get('app')
+    if receiver is not None:
+        receiver.start_worker()
+        worker.log.info(f"App loaded in {receiver.startup_seconds * 1000:.0f} ms")
+
+
+def worker_exit(server, worker):
+    """Drain queued work and snapshot state once the worker stops taking requests"""
+    receiver = sys.modules.get('app')
+    if receiver is None:
+        return
+    result = receiver.shutdown()
+    if result is not None:
+        elapsed, pending = result
+        worker.log.info(f"Drained in {elapsed * 1000:.0f} ms, {pending} deliveries left pending")
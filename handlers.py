@@ -0,0 +1,161 @@
+import time
+import asyncio
+import logging
+import threading
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+
+from perprocess import PerProcess
+
+logger = logging.getLogger(__name__)
+
+HANDLER_MODES = ('sync', 'thread', 'async')
+
+# Meta subscribes to 'messaging' but events carry field 'messages'
+FIELD_ALIASES = {'messaging': 'messages'}
+
+
+class Handler:
+    """One subscribed callable with its execution mode, timeout and latency stats"""
+
+    def __init__(self, func, mode, timeout, name):
+        self.func = func
+        self.mode = mode
+        self.timeout = timeout
+        self.name = name
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self._time_total = 0.0
+        self._time_max = 0.0
+
+    def record(self, elapsed, error=False, timed_out=False):
+        with self._lock:
+            self.calls += 1
+            self.errors += error
+            self.timeouts += timed_out
+            self._time_total += elapsed
+            self._time_max = max(self._time_max, elapsed)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'timeout': self.timeout,
+                'calls': self.calls,
+                'errors': self.errors,
+                'timeouts': self.timeouts,
+                'latency_ms': {
+                    'avg': round(self._time_total / self.calls * 1000, 3) if self.calls else 0.0,
+                    'max': round(self._time_max * 1000, 3),
+                },
+            }
+
+
+class HandlerRegistry:
+    """Routes stored events to handlers subscribed to (object, field) pairs.
+
+    Either side of a pair may be '*'. Subscriptions are compiled into a dict
+    keyed by (object, field) the first time a pair is seen, so routing an event
+    is one lookup however many handlers exist. 'sync' handlers run in the
+    caller, 'thread' handlers in a shared pool and 'async' handlers on an event
+    loop in a background thread. Async handlers are cancelled at their timeout;
+    sync and thread handlers can't be interrupted, so overruns are only counted.
+    """
+
+    def __init__(self, threads=4, default_timeout=5.0):
+        self.threads = threads
+        self.default_timeout = default_timeout
+        self._subscriptions = []
+        self._table = {}
+        self._lock = threading.Lock()
+        self._started = PerProcess(self._start)
+        self._pool = None
+        self._loop = None
+
+    def subscribe(self, obj, field, mode='sync', timeout=None, name=None):
+        """Decorator registering a handler for (obj, field)"""
+        def decorator(func):
+            self.register(obj, field, func, mode, timeout, name)
+            return func
+        return decorator
+
+    def register(self, obj, field, func, mode='sync', timeout=None, name=None):
+        if mode not in HANDLER_MODES:
+            raise ValueError(f"Unknown handler mode: {mode}")
+        if mode == 'async' and not asyncio.iscoroutinefunction(func):
+            raise ValueError(f"Async handler {func.__name__} must be a coroutine function")
+
+        handler = Handler(func, mode, timeout or self.default_timeout, name or f'{func.__module__}.{func.__name__}')
+        with self._lock:
+            self._subscriptions.append((obj, FIELD_ALIASES.get(field, field), handler))
+            # Recompiled lazily per pair on the next dispatch
+            self._table = {}
+        return handler
+
+    def load(self, modules):
+        """Import handler modules; each exposes register(registry)"""
+        for name in modules:
+            importlib.import_module(name).register(self)
+            logger.info(f"Loaded event handlers from {name}")
+
+    def handlers_for(self, obj, field):
+        handlers = self._table.get((obj, field))
+        if handlers is None:
+            handlers = tuple(
+                handler for sub_obj, sub_field, handler in self._subscriptions
+                if sub_obj in ('*', obj) and sub_field in ('*', field)
+            )
+            self._table[(obj, field)] = handlers
+        return handlers
+
+    def dispatch(self, events):
+        """Hand each event to every handler subscribed to its (object, field)"""
+        if not self._subscriptions:
+            return
+        self._started.ensure()
+        for event in events:
+            for handler in self.handlers_for(event['object'], event['field']):
+                if handler.mode == 'sync':
+                    self._run(handler, event)
+                elif handler.mode == 'thread':
+                    self._pool.submit(self._run, handler, event)
+                else:
+                    asyncio.run_coroutine_threadsafe(self._run_async(handler, event), self._loop)
+
+    def stats(self):
+        return {handler.name: handler.stats() for _, _, handler in self._subscriptions}
+
+    def _start(self):
+        self._pool = ThreadPoolExecutor(self.threads, thread_name_prefix='event-handler')
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name='event-handler-loop', daemon=True).start()
+
+    def _run(self, handler, event):
+        started = time.perf_counter()
+        error = False
+        try:
+            handler.func(event)
+        except Exception as e:
+            logger.error(f"Event handler {handler.name} failed: {str(e)}")
+            error = True
+        elapsed = time.perf_counter() - started
+
+        timed_out = elapsed > handler.timeout
+        if timed_out:
+            logger.warning(f"Event handler {handler.name} took {elapsed:.3f}s (timeout {handler.timeout}s)")
+        handler.record(elapsed, error, timed_out)
+
+    async def _run_async(self, handler, event):
+        started = time.perf_counter()
+        error = timed_out = False
+        try:
+            await asyncio.wait_for(handler.func(event), handler.timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Event handler {handler.name} cancelled after {handler.timeout}s")
+            timed_out = True
+        except Exception as e:
+            logger.error(f"Event handler {handler.name} failed: {str(e)}")
+            error = True
+        handler.record(time.perf_counter() - started, error, timed_out)
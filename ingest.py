@@ -0,0 +1,363 @@
+import os
+import queue
+import asyncio
+import threading
+import time
+import logging
+
+from perprocess import PerProcess
+
+logger = logging.getLogger(__name__)
+
+BACKPRESSURE_POLICIES = ('block', 'shed', 'spill')
+
+
+def spill(spill_dir, payload, signature_valid):
+    """Write a delivery to `spill_dir`, returns False if it couldn't be written"""
+    # File name sorts by arrival time; the suffix records the signature status
+    name = f"{time.time_ns():020d}-{os.getpid()}-{'v' if signature_valid else 'u'}.json"
+    path = os.path.join(spill_dir, name)
+    try:
+        with open(path + '.tmp', 'wb') as f:
+            f.write(payload)
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        logger.error(f"Failed to spill webhook delivery: {str(e)}")
+        return False
+    return True
+
+
+def spill_files(spill_dir):
+    """Spilled deliveries, oldest first"""
+    try:
+        return sorted(n for n in os.listdir(spill_dir) if n.endswith('.json'))
+    except OSError:
+        return []
+
+
+def unspill(spill_dir, name):
+    """(payload, signature_valid) of a spilled delivery, removing it; None if another process took it"""
+    path = os.path.join(spill_dir, name)
+    try:
+        with open(path, 'rb') as f:
+            payload = f.read()
+        os.remove(path)
+    except OSError:
+        return None
+    return payload, name.endswith('-v.json')
+
+
+class IngestQueue:
+    """Bounded queue of raw webhook deliveries drained by a pool of worker threads.
+
+    The webhook handler only verifies the signature and calls put(); parsing,
+    classification and storage happen in the workers via `handler`.
+    When the queue is full the backpressure policy decides what happens:
+    'block' waits up to `block_timeout` seconds, 'shed' drops the delivery and
+    'spill' writes it to `spill_dir` to be re-queued once there is room. With
+    `max_spill` set, deliveries are dropped once that many are waiting on disk.
+    """
+
+    def __init__(self, handler, maxsize=1000, workers=4, policy='block',
+                 block_timeout=0.5, spill_dir=None, max_spill=0):
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {policy}")
+        if policy == 'spill' and not spill_dir:
+            raise ValueError("spill_dir is required for the 'spill' policy")
+
+        self.handler = handler
+        self.maxsize = maxsize
+        self.workers = workers
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.spill_dir = spill_dir
+        self.max_spill = max_spill
+
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._started = PerProcess(self._start_threads)
+        # Files waiting in spill_dir, recounted on every unspill pass
+        self._spill_pending = 0
+
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.spilled = 0
+        self._enqueue_time_total = 0.0
+        self._enqueue_time_max = 0.0
+
+    def start(self):
+        """Start the worker threads in the current process (no-op if running)"""
+        self._started.ensure()
+
+    def _start_threads(self):
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f'ingest-worker-{i}', daemon=True).start()
+
+        if self.policy == 'spill':
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self._spill_pending = len(self._spill_files())
+            threading.Thread(target=self._unspill, name='ingest-unspill', daemon=True).start()
+
+    def put(self, payload, signature_valid):
+        """Enqueue a raw delivery, returns False if it was dropped"""
+        self.start()
+        item = (payload, signature_valid)
+
+        started = time.perf_counter()
+        try:
+            if self.policy == 'block':
+                self._queue.put(item, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(item)
+            accepted = True
+        except queue.Full:
+            accepted = self.policy == 'spill' and self._spill(payload, signature_valid)
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            self._enqueue_time_total += elapsed
+            self._enqueue_time_max = max(self._enqueue_time_max, elapsed)
+            if accepted:
+                self.enqueued += 1
+            else:
+                self.dropped += 1
+
+        if not accepted:
+            logger.warning("Ingest queue full, dropped webhook delivery")
+        return accepted
+
+    def drain(self, timeout):
+        """Wait up to `timeout` seconds for queued deliveries, then take back what's left"""
+        deadline = time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._queue.all_tasks_done.wait(remaining)
+
+        leftover = []
+        while True:
+            try:
+                leftover.append(self._queue.get_nowait())
+            except queue.Empty:
+                return leftover
+            self._queue.task_done()
+
+    def stats(self):
+        """Queue depth, throughput counters and enqueue latency"""
+        # Kept up to date by spills and unspill passes; listing the directory
+        # here would hold up put() on the ack path
+        spill_pending = self._spill_pending
+        with self._lock:
+            calls = self.enqueued + self.dropped
+            return {
+                'mode': 'queue',
+                'policy': self.policy,
+                'workers': self.workers,
+                'depth': self._queue.qsize(),
+                'maxsize': self.maxsize,
+                'enqueued': self.enqueued,
+                'processed': self.processed,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'spilled': self.spilled,
+                'spill_pending': spill_pending,
+                'max_spill': self.max_spill,
+                'enqueue_latency_ms': {
+                    'avg': round(self._enqueue_time_total / calls * 1000, 3) if calls else 0.0,
+                    'max': round(self._enqueue_time_max * 1000, 3),
+                },
+            }
+
+    def _work(self):
+        while True:
+            payload, signature_valid = self._queue.get()
+            try:
+                self.handler(payload, signature_valid)
+                ok = True
+            except Exception as e:
+                logger.error(f"Ingest worker failed to process webhook: {str(e)}")
+                ok = False
+            finally:
+                self._queue.task_done()
+
+            with self._lock:
+                if ok:
+                    self.processed += 1
+                else:
+                    self.failed += 1
+
+    def _spill(self, payload, signature_valid):
+        if self.max_spill and self._spill_pending >= self.max_spill:
+            return False
+        if not spill(self.spill_dir, payload, signature_valid):
+            return False
+        with self._lock:
+            self.spilled += 1
+            self._spill_pending += 1
+        return True
+
+    def _spill_files(self):
+        return spill_files(self.spill_dir)
+
+    def _unspill(self):
+        """Move spilled deliveries back onto the queue as space frees up"""
+        while True:
+            time.sleep(0.5)
+            names = self._spill_files()
+            self._spill_pending = len(names)
+            for name in names:
+                if self._queue.full():
+                    break
+                item = unspill(self.spill_dir, name)
+                # None when another worker process picked it up first
+                if item is not None:
+                    with self._lock:
+                        self._spill_pending -= 1
+                    self._queue.put(item)
+
+
+class AsyncIngestQueue:
+    """asyncio counterpart of IngestQueue for the ASGI entry point.
+
+    Consumer tasks run on the event loop. 'spill' writes overflow to
+    `spill_dir` in the default executor, in the same format as IngestQueue,
+    and a task moves it back onto the queue as space frees up.
+    """
+
+    def __init__(self, handler, maxsize=1000, workers=4, policy='block', block_timeout=0.5, spill_dir=None):
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {policy}")
+        if policy == 'spill' and not spill_dir:
+            raise ValueError("spill_dir is required for the 'spill' policy")
+
+        self.handler = handler
+        self.maxsize = maxsize
+        self.workers = workers
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.spill_dir = spill_dir
+
+        self._queue = None
+        self._tasks = []
+        # Files waiting in spill_dir, recounted on every unspill pass
+        self._spill_pending = 0
+
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.spilled = 0
+        self._enqueue_time_total = 0.0
+        self._enqueue_time_max = 0.0
+
+    def start(self):
+        """Start the consumer tasks on the running event loop (no-op if running)"""
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        if self.policy == 'spill':
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self._tasks.append(asyncio.create_task(self._unspill()))
+
+    async def stop(self, timeout=10.0):
+        """Wait up to `timeout` seconds for queued deliveries, cancel the consumers
+        and return the deliveries that were still queued"""
+        if self._queue is None:
+            return []
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Ingest queue not drained, {self._queue.qsize()} deliveries left")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        leftover = []
+        while not self._queue.empty():
+            leftover.append(self._queue.get_nowait())
+        return leftover
+
+    async def put(self, payload, signature_valid):
+        """Enqueue a raw delivery, returns False if it was dropped"""
+        item = (payload, signature_valid)
+
+        started = time.perf_counter()
+        try:
+            self._queue.put_nowait(item)
+            accepted = True
+        except asyncio.QueueFull:
+            accepted = False
+            if self.policy == 'block':
+                try:
+                    await asyncio.wait_for(self._queue.put(item), self.block_timeout)
+                    accepted = True
+                except asyncio.TimeoutError:
+                    pass
+            elif self.policy == 'spill':
+                loop = asyncio.get_running_loop()
+                accepted = await loop.run_in_executor(None, spill, self.spill_dir, payload, signature_valid)
+                if accepted:
+                    self.spilled += 1
+                    self._spill_pending += 1
+        elapsed = time.perf_counter() - started
+
+        self._enqueue_time_total += elapsed
+        self._enqueue_time_max = max(self._enqueue_time_max, elapsed)
+        if accepted:
+            self.enqueued += 1
+        else:
+            self.dropped += 1
+            logger.warning("Ingest queue full, dropped webhook delivery")
+        return accepted
+
+    def stats(self):
+        calls = self.enqueued + self.dropped
+        return {
+            'mode': 'asyncio',
+            'policy': self.policy,
+            'workers': self.workers,
+            'depth': self._queue.qsize() if self._queue is not None else 0,
+            'maxsize': self.maxsize,
+            'enqueued': self.enqueued,
+            'processed': self.processed,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'spilled': self.spilled,
+            'spill_pending': self._spill_pending,
+            'enqueue_latency_ms': {
+                'avg': round(self._enqueue_time_total / calls * 1000, 3) if calls else 0.0,
+                'max': round(self._enqueue_time_max * 1000, 3),
+            },
+        }
+
+    async def _unspill(self):
+        """Move spilled deliveries back onto the queue as space frees up"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(0.5)
+            names = await loop.run_in_executor(None, spill_files, self.spill_dir)
+            self._spill_pending = len(names)
+            for name in names:
+                if self._queue.full():
+                    break
+                item = await loop.run_in_executor(None, unspill, self.spill_dir, name)
+                if item is not None:
+                    self._spill_pending -= 1
+                    await self._queue.put(item)
+
+    async def _work(self):
+        while True:
+            payload, signature_valid = await self._queue.get()
+            try:
+                await self.handler(payload, signature_valid)
+                self.processed += 1
+            except Exception as e:
+                logger.error(f"Ingest task failed to process webhook: {str(e)}")
+                self.failed += 1
+            finally:
+                self._queue.task_done()
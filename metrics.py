@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import bisect
+import weakref
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+from perprocess import PerProcess
+
+# Seconds; webhook stages are expected to take microseconds to milliseconds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# Bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Metrics:
+    """Prometheus-style counters and histograms with per-thread shards.
+
+    Every thread updates its own dict, so recording never takes a lock; shards
+    are only merged when metrics are collected, or into a per-process base
+    when their thread exits, so short-lived threads don't pile up. When `directory` is set each
+    process periodically writes its totals there and collect() sums the files
+    of all gunicorn workers.
+    """
+
+    def __init__(self, directory=None, flush_interval=5.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._definitions = {}
+        self._local = threading.local()
+        # id -> shard of every live thread, plus the totals of exited ones
+        self._shards = {}
+        self._base = {}
+        self._lock = threading.Lock()
+        self._process = PerProcess(self._start_process)
+
+    def counter(self, name, help, labelnames=()):
+        self._definitions[name] = ('counter', help, tuple(labelnames), None)
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self._definitions[name] = ('histogram', help, tuple(labelnames), tuple(buckets))
+
+    def inc(self, name, labels=(), amount=1):
+        shard = self._shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def observe(self, name, value, labels=()):
+        shard = self._shard()
+        key = (name, labels)
+        buckets = self._definitions[name][3]
+        # Per-bucket counts (not cumulative), then +Inf, sum and count
+        values = shard.get(key)
+        if values is None:
+            values = shard[key] = [0] * (len(buckets) + 1) + [0.0, 0]
+        values[bisect.bisect_left(buckets, value)] += 1
+        values[-2] += value
+        values[-1] += 1
+
+    @contextmanager
+    def timer(self, name, labels=()):
+        """Observe the duration of the block in seconds"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, labels)
+
+    def snapshot(self):
+        """Merged totals of every thread in this process"""
+        totals = {}
+        with self._lock:
+            shards = list(self._shards.values())
+            for key, value in self._base.items():
+                _merge(totals, key, value)
+
+        for shard in shards:
+            for key, value in list(shard.items()):
+                _merge(totals, key, value)
+        return totals
+
+    def flush(self):
+        """Write this process's totals for the other workers to read"""
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'metrics-{os.getpid()}.json')
+        rows = [[name, list(labels), value] for (name, labels), value in self.snapshot().items()]
+        with open(path + '.tmp', 'w') as f:
+            json.dump(rows, f)
+        os.replace(path + '.tmp', path)
+
+    def collect(self):
+        """Totals across all worker processes (or just this one without a directory)"""
+        if not self.directory:
+            return self.snapshot()
+
+        self.flush()
+        totals = {}
+        for name in os.listdir(self.directory):
+            if not (name.startswith('metrics-') and name.endswith('.json')):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    rows = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for metric, labels, value in rows:
+                _merge(totals, (metric, tuple(labels)), value)
+        return totals
+
+    def render(self):
+        """Prometheus text exposition format"""
+        totals = self.collect()
+        lines = []
+        for name, (kind, help, labelnames, buckets) in self._definitions.items():
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for (metric, labels), value in sorted(totals.items()):
+                if metric != name:
+                    continue
+                pairs = [f'{k}="{_escape(v)}"' for k, v in zip(labelnames, labels)]
+                if kind == 'counter':
+                    lines.append(f'{name}{_labels(pairs)} {value}')
+                    continue
+
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), value[:-2]):
+                    cumulative += count
+                    le = f'le="{bound}"'
+                    lines.append(f'{name}_bucket{_labels(pairs + [le])} {cumulative}')
+                lines.append(f'{name}_sum{_labels(pairs)} {value[-2]}')
+                lines.append(f'{name}_count{_labels(pairs)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None or self._local.pid != os.getpid():
+            shard = {}
+            with self._lock:
+                self._process.ensure()
+                self._shards[id(shard)] = shard
+            # Thread locals are cleared when the thread exits, which fires this
+            token = self._local.token = _ThreadToken()
+            weakref.finalize(token, self._retire, shard).atexit = False
+            self._local.shard = shard
+            self._local.pid = os.getpid()
+        return shard
+
+    def _retire(self, shard):
+        with self._lock:
+            # Not ours if it was inherited across fork
+            if self._shards.get(id(shard)) is not shard:
+                return
+            del self._shards[id(shard)]
+            for key, value in shard.items():
+                _merge(self._base, key, value)
+
+    def _start_process(self):
+        # Shards copied from the parent across fork belong to the parent
+        self._shards = {}
+        self._base = {}
+        if self.directory:
+            threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+
+class PeakMemory:
+    """Peak Python heap growth while handling each request, via tracemalloc.
+
+    tracemalloc's peak is process-wide, so with concurrent requests a figure
+    can include another thread's allocations; treat it as an upper bound.
+    Tracing slows every allocation down, so this is opt-in.
+    """
+
+    def __init__(self, on_peak=None):
+        self.on_peak = on_peak
+        self._lock = threading.Lock()
+        self.requests = 0
+        self._total = 0
+        self._max = 0
+        tracemalloc.start()
+
+    @contextmanager
+    def track(self):
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            peak = max(0, tracemalloc.get_traced_memory()[1] - baseline)
+            with self._lock:
+                self.requests += 1
+                self._total += peak
+                self._max = max(self._max, peak)
+            if self.on_peak is not None:
+                self.on_peak(peak)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'avg_bytes': self._total // self.requests if self.requests else 0,
+                'max_bytes': self._max,
+            }
+
+
+class _ThreadToken:
+    __slots__ = ('__weakref__',)
+
+
+def _merge(totals, key, value):
+    if isinstance(value, list):
+        current = totals.get(key)
+        totals[key] = [a + b for a, b in zip(current, value)] if current else list(value)
+    else:
+        totals[key] = totals.get(key, 0) + value
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    return '{' + ','.join(pairs) + '}' if pairs else ''
@@ -0,0 +1,269 @@
+import json
+import time
+import threading
+from collections import Counter, deque
+
+# Bytes kept of a quarantined delivery's raw body, or of an entry or item as JSON
+MAX_RAW_BYTES = 64 * 1024
+
+_ID = (str, int)
+_NUMBER = (int, float)
+
+
+def _lookup(item, keys):
+    for key in keys:
+        if not isinstance(item, dict):
+            return None
+        item = item.get(key)
+    return item
+
+
+def compile_schema(schema):
+    """Build a validator from (dotted path, types, required) rules.
+
+    The rules are turned into the source of one function, with every lookup,
+    type check and message written out inline, and compiled once. Validating
+    an item then costs a few dict lookups and isinstance() calls, returning
+    None if it's valid or the reason it isn't.
+    """
+    lines = ['def validate(item):', '    if not isinstance(item, dict):', "        return 'not an object'"]
+    namespace = {}
+    for i, (path, types, required) in enumerate(schema):
+        keys = path.split('.')
+        namespace[f'types_{i}'] = types
+        lines.append(f'    value = item.get({keys[0]!r})')
+        for key in keys[1:]:
+            lines.append(f'    value = value.get({key!r}) if isinstance(value, dict) else None')
+        missing = f'missing {path}'
+        wrong_type = f"{path} must be {' or '.join(t.__name__ for t in types)}"
+        # bool is an int subclass, but true/false is never a valid id or time
+        check = f'not isinstance(value, types_{i})'
+        if int in types:
+            check += ' or value is True or value is False'
+        lines.append('    if value is None:')
+        lines.append(f'        return {missing!r}' if required else '        pass')
+        lines.append(f'    elif {check}:')
+        lines.append(f'        return {wrong_type!r}')
+    lines.append('    return None')
+
+    exec(compile('\n'.join(lines), f'<schema {len(schema)} rules>', 'exec'), namespace)
+    return namespace['validate']
+
+
+def _getter(path):
+    keys = tuple(path.split('.'))
+    return lambda item: _lookup(item, keys)
+
+
+def epoch_seconds(value):
+    # entry.time is in seconds, messaging timestamps are in milliseconds
+    if not isinstance(value, _NUMBER):
+        return None
+    return value / 1000 if value > 1e11 else value
+
+
+def _str(value):
+    return str(value) if value is not None else None
+
+
+validate_entry = compile_schema((
+    ('id', _ID, False),
+    ('time', _NUMBER, False),
+    ('messaging', (list,), False),
+    ('changes', (list,), False),
+))
+
+
+class Event:
+    """A normalized event: one change or messaging item of a delivery.
+
+    Subclasses describe one kind of item with a `schema`, compiled into
+    `validate` when the class is defined, and dotted paths to its sender and
+    media id. The item itself is kept as `data`.
+    """
+
+    __slots__ = ('object', 'field', 'object_id', 'event_time', 'sender', 'media_id', 'data')
+
+    schema = ()
+    sender_path = None
+    media_paths = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.validate = staticmethod(compile_schema(cls.schema))
+        cls._sender = staticmethod(_getter(cls.sender_path)) if cls.sender_path else staticmethod(lambda item: None)
+        cls._media = tuple(_getter(path) for path in cls.media_paths)
+
+    def __init__(self, obj, field, object_id, entry_time, item):
+        self.object = obj
+        self.field = field
+        self.object_id = object_id
+        self.event_time = entry_time
+        self.sender = _str(self._sender(item))
+        self.media_id = None
+        for media in self._media:
+            value = media(item)
+            if value is not None:
+                self.media_id = str(value)
+                break
+        self.data = item
+
+    def as_record(self):
+        """The dict the event store, forwarder and handlers take"""
+        return {
+            'object': self.object,
+            'field': self.field,
+            'object_id': self.object_id,
+            'event_time': self.event_time,
+            'sender': self.sender,
+            'media_id': self.media_id,
+            'data': self.data,
+        }
+
+
+class Message(Event):
+    """Instagram or Messenger messaging item (messages, reactions, postbacks, reads)"""
+
+    __slots__ = ()
+
+    schema = (
+        ('sender.id', _ID, True),
+        ('recipient.id', _ID, True),
+        ('timestamp', _NUMBER, False),
+        ('message', (dict,), False),
+        ('message.mid', (str,), False),
+        ('message.text', (str,), False),
+    )
+    sender_path = 'sender.id'
+
+    def __init__(self, obj, field, object_id, entry_time, item):
+        super().__init__(obj, field, object_id, entry_time, item)
+        self.event_time = epoch_seconds(item.get('timestamp')) or entry_time
+
+
+class Change(Event):
+    """Change item of a field without a more specific model"""
+
+    __slots__ = ()
+
+    schema = (
+        ('field', (str,), True),
+    )
+    sender_path = 'value.from.id'
+    media_paths = ('value.media.id', 'value.media_id')
+
+
+class Comment(Change):
+    """Instagram comment or live comment"""
+
+    __slots__ = ()
+
+    schema = (
+        ('field', (str,), True),
+        ('value', (dict,), True),
+        ('value.id', _ID, True),
+        ('value.text', (str,), False),
+        ('value.from.id', _ID, False),
+        ('value.media.id', _ID, False),
+    )
+
+
+class Mention(Change):
+    """Instagram @mention in a caption or comment"""
+
+    __slots__ = ()
+
+    schema = (
+        ('field', (str,), True),
+        ('value', (dict,), True),
+        ('value.media_id', _ID, True),
+        ('value.comment_id', _ID, False),
+    )
+
+
+class PageEvent(Change):
+    """Facebook Page change (feed, mention, ratings, ...)"""
+
+    __slots__ = ()
+
+    schema = (
+        ('field', (str,), True),
+        ('value', (dict,), True),
+        ('value.from.id', _ID, False),
+        ('value.post_id', (str,), False),
+        ('value.item', (str,), False),
+        ('value.verb', (str,), False),
+    )
+
+
+# (object, field) -> model for change items; '*' matches any field of the object.
+# Messaging items are always Messages
+MODELS = {
+    ('instagram', 'comments'): Comment,
+    ('instagram', 'live_comments'): Comment,
+    ('instagram', 'mentions'): Mention,
+    ('page', '*'): PageEvent,
+}
+
+
+def model_for(obj, field):
+    """Model for change items of (object, field)"""
+    return MODELS.get((obj, field)) or MODELS.get((obj, '*')) or Change
+
+
+class Quarantine:
+    """Most recent items that failed validation, each with the reason.
+
+    Bounded by `maxsize`, with each item's data kept as text of at most
+    MAX_RAW_BYTES; counts by level ('delivery', 'entry' or 'item')
+    cover every item ever quarantined, including ones pushed out.
+    """
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self._items = deque(maxlen=maxsize)
+        self._lock = threading.Lock()
+        self.counts = Counter()
+
+    def add(self, level, reason, obj=None, field=None, object_id=None, signature_status=None, data=None):
+        if isinstance(data, (bytes, bytearray)):
+            data = data[:MAX_RAW_BYTES].decode('utf-8', 'replace')
+        elif data is not None:
+            # Entries and items can be as big as the delivery, signed or not
+            data = json.dumps(data, default=str)[:MAX_RAW_BYTES]
+        with self._lock:
+            self._items.append({
+                'quarantined_at': time.time(),
+                'level': level,
+                'reason': reason,
+                'object': obj,
+                'field': field,
+                'object_id': object_id,
+                'signature_status': signature_status,
+                'data': data,
+            })
+            self.counts[level] += 1
+
+    def recent(self, limit=50, level=None):
+        """Newest first"""
+        with self._lock:
+            items = list(self._items)
+        items.reverse()
+        if level is not None:
+            items = [item for item in items if item['level'] == level]
+        return items[:limit]
+
+    def snapshot(self):
+        with self._lock:
+            return {'items': list(self._items), 'counts': dict(self.counts)}
+
+    def restore(self, state):
+        """Put a previous process's items ahead of ours and add its counts"""
+        with self._lock:
+            self._items = deque(state['items'] + list(self._items), maxlen=self.maxsize)
+            self.counts.update(state['counts'])
+            return len(self._items)
+
+    def stats(self):
+        with self._lock:
+            return {'items': len(self._items), 'maxsize': self.maxsize, 'quarantined': dict(self.counts)}
@@ -0,0 +1,114 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Encodings we can serve, in order of preference
+ENCODINGS = ('br', 'gzip', 'identity') if brotli else ('gzip', 'identity')
+
+
+class CachedPage:
+    """A rendered page served with an ETag, 304s and compressed variants.
+
+    Compressed bodies are produced once per page, up front when `precompress`
+    is set or on the first request that accepts the encoding otherwise.
+    """
+
+    def __init__(self, body, etag=None, cache_control='no-cache', precompress=False,
+                 mimetype='text/html; charset=utf-8'):
+        self.body = body.encode('utf-8') if isinstance(body, str) else body
+        self.etag = etag or hashlib.blake2b(self.body, digest_size=16).hexdigest()
+        self.cache_control = cache_control
+        self.mimetype = mimetype
+        self._encoded = {'identity': self.body}
+        self._lock = threading.Lock()
+        # Pages compressed at startup can afford the slowest, smallest setting
+        self._level = 9 if precompress else 6
+        if precompress:
+            for encoding in ENCODINGS:
+                self._encode(encoding)
+
+    def response(self):
+        """304 if the client has this version, otherwise the best encoded body it accepts"""
+        if request.if_none_match.contains_weak(self.etag):
+            return not_modified(self.etag, self.cache_control)
+
+        encoding = request.accept_encodings.best_match(ENCODINGS, default='identity')
+        response = Response(self._encode(encoding), mimetype=self.mimetype)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+
+        # Weak, since the same tag covers every encoding of the page
+        response.set_etag(self.etag, weak=True)
+        response.headers['Cache-Control'] = self.cache_control
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def _encode(self, encoding):
+        body = self._encoded.get(encoding)
+        if body is None:
+            with self._lock:
+                body = self._encoded.get(encoding)
+                if body is None:
+                    if encoding == 'br':
+                        body = brotli.compress(self.body, quality=11 if self._level == 9 else 5)
+                    else:
+                        body = gzip.compress(self.body, compresslevel=self._level)
+                    self._encoded[encoding] = body
+        return body
+
+
+def not_modified(etag, cache_control='no-cache'):
+    response = Response(status=304)
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+class PageCache:
+    """Recently rendered versions of a dynamic page, keyed by ETag.
+
+    The caller derives the ETag from whatever the page depends on, so a viewer
+    with a current copy gets a 304 and concurrent viewers of the same version
+    share one render and one compressed body.
+    """
+
+    def __init__(self, maxsize=8, cache_control='no-cache'):
+        self.maxsize = maxsize
+        self.cache_control = cache_control
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+        self.renders = 0
+        self.hits = 0
+        self.not_modified = 0
+
+    def response(self, etag, render):
+        """Serve the version tagged `etag`, calling render() only if it isn't cached"""
+        if request.if_none_match.contains_weak(etag):
+            self.not_modified += 1
+            return not_modified(etag, self.cache_control)
+
+        with self._lock:
+            page = self._pages.get(etag)
+            if page is not None:
+                self._pages.move_to_end(etag)
+                self.hits += 1
+        if page is None:
+            page = CachedPage(render(), etag=etag, cache_control=self.cache_control)
+            with self._lock:
+                self.renders += 1
+                self._pages[etag] = page
+                if len(self._pages) > self.maxsize:
+                    self._pages.popitem(last=False)
+        return page.response()
+
+    def stats(self):
+        return {'renders': self.renders, 'hits': self.hits, 'not_modified': self.not_modified}
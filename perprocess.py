@@ -0,0 +1,28 @@
+import os
+import threading
+
+
+class PerProcess:
+    """Runs `start` once in every process that calls ensure().
+
+    Threads don't survive fork, so each gunicorn worker has to start its own
+    background threads. Once started, ensure() costs one getpid() comparison.
+    """
+
+    def __init__(self, start):
+        self._start = start
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid != pid:
+                self._start()
+                self._pid = pid
+
+    def started(self):
+        """Whether start ran in this process"""
+        return self._pid == os.getpid()
@@ -0,0 +1,192 @@
+import os
+import sys
+import time
+import random
+import threading
+from collections import Counter, deque
+
+from perprocess import PerProcess
+
+# Distinct stacks kept in the aggregate profile; rarer ones past this are dropped
+MAX_STACKS = 10000
+
+
+class Trace:
+    """Timings and payload metadata for one request or background processing run"""
+
+    __slots__ = ('kind', 'started_at', 'started', 'stages', 'meta', 'folded', 'thread_id')
+
+    def __init__(self, kind, sampled):
+        self.kind = kind
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.meta = {}
+        self.folded = Counter() if sampled else None
+        self.thread_id = threading.get_ident()
+
+
+def _fold(frame):
+    # Root first, as flamegraph.pl / speedscope expect
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Profiler:
+    """Opt-in profiling for the webhook path.
+
+    Every traced request records per-stage timings; requests slower than
+    `slow_ms` are kept, with their payload metadata, in a ring of `ring_size`.
+    A `sample_rate` fraction of requests is also stack-sampled every
+    `interval` seconds by one background thread reading sys._current_frames(),
+    which costs nothing while no sampled request is running. Samples are
+    aggregated as folded stacks for flamegraph tools.
+    """
+
+    def __init__(self, sample_rate=0.01, interval=0.001, slow_ms=250, ring_size=100):
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.slow_ms = slow_ms
+        self._local = threading.local()
+        self._active = {}
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._sampler = PerProcess(self._start_sampler)
+        self._next_id = 1
+
+        self.slow = deque(maxlen=ring_size)
+        self.folded = Counter()
+        self.traces = 0
+        self.sampled = 0
+        self.samples = 0
+
+    def current(self):
+        return getattr(self._local, 'trace', None)
+
+    def trace(self, kind):
+        """Context manager tracing the block, or joining the trace already running in this thread"""
+        return _TraceContext(self, kind)
+
+    def stage(self, name, elapsed):
+        trace = self.current()
+        if trace is not None:
+            trace.stages[name] = trace.stages.get(name, 0.0) + elapsed
+
+    def annotate(self, **meta):
+        trace = self.current()
+        if trace is not None:
+            trace.meta.update(meta)
+
+    def count(self, items, name):
+        """Pass `items` through, counting them into the active trace's metadata as `name`"""
+        trace = self.current()
+        if trace is None:
+            yield from items
+            return
+        trace.meta[name] = 0
+        for item in items:
+            trace.meta[name] += 1
+            yield item
+
+    def find(self, slow_id):
+        with self._lock:
+            return next((record for record in self.slow if record['id'] == slow_id), None)
+
+    def slow_requests(self):
+        """Newest first, without their stacks"""
+        with self._lock:
+            return [{k: v for k, v in record.items() if k != 'folded'} for record in reversed(self.slow)]
+
+    def render_folded(self, folded=None):
+        """Brendan Gregg's folded format: one 'frame;frame;frame count' line per stack"""
+        with self._lock:
+            folded = Counter(self.folded if folded is None else folded)
+        return ''.join(f'{stack} {count}\n' for stack, count in folded.most_common())
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sample_rate': self.sample_rate,
+                'interval': self.interval,
+                'slow_ms': self.slow_ms,
+                'traces': self.traces,
+                'sampled': self.sampled,
+                'samples': self.samples,
+                'slow_captured': len(self.slow),
+                'stacks': len(self.folded),
+            }
+
+    def _begin(self, kind):
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        trace = self._local.trace = Trace(kind, sampled)
+        if sampled:
+            self._sampler.ensure()
+            with self._lock:
+                self._active[trace.thread_id] = trace
+            self._wakeup.set()
+        return trace
+
+    def _end(self, trace):
+        self._local.trace = None
+        duration_ms = (time.perf_counter() - trace.started) * 1000
+        with self._lock:
+            if trace.folded is not None:
+                self._active.pop(trace.thread_id, None)
+                if not self._active:
+                    self._wakeup.clear()
+                self.sampled += 1
+                for stack, count in trace.folded.items():
+                    if stack in self.folded or len(self.folded) < MAX_STACKS:
+                        self.folded[stack] += count
+            self.traces += 1
+
+            if duration_ms >= self.slow_ms:
+                self.slow.append({
+                    'id': self._next_id,
+                    'kind': trace.kind,
+                    'started_at': trace.started_at,
+                    'duration_ms': round(duration_ms, 3),
+                    'stages_ms': {name: round(s * 1000, 3) for name, s in trace.stages.items()},
+                    **trace.meta,
+                    'sampled': trace.folded is not None,
+                    'folded': dict(trace.folded) if trace.folded is not None else None,
+                })
+                self._next_id += 1
+
+    def _start_sampler(self):
+        threading.Thread(target=self._sample_loop, name='profiler', daemon=True).start()
+
+    def _sample_loop(self):
+        while True:
+            self._wakeup.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, trace in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        trace.folded[_fold(frame)] += 1
+                        self.samples += 1
+
+
+class _TraceContext:
+    __slots__ = ('profiler', 'kind', 'trace')
+
+    def __init__(self, profiler, kind):
+        self.profiler = profiler
+        self.kind = kind
+        self.trace = None
+
+    def __enter__(self):
+        if self.profiler.current() is None:
+            self.trace = self.profiler._begin(self.kind)
+        return self.profiler.current()
+
+    def __exit__(self, *exc):
+        if self.trace is not None:
+            self.profiler._end(self.trace)
+        return False
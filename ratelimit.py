@@ -0,0 +1,73 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class RateLimiter:
+    """Token buckets keyed by an arbitrary string (page/IG account id, client IP).
+
+    Each key refills at `rate` tokens per second up to `burst` (at least 1). A
+    full bucket admits any cost and goes into debt that refills pay off, so
+    work bigger than the burst is slowed down rather than refused forever.
+    Keys live in an LRU dict bounded by `max_keys`, so checks are O(1) and
+    memory stays flat however many distinct keys show up.
+    """
+
+    def __init__(self, rate, burst=None, max_keys=10000):
+        self.rate = rate
+        self.burst = max(1, burst or rate)
+        self.max_keys = max_keys
+        # key -> [tokens, last refill, allowed, throttled]
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.throttled = 0
+
+    def allow(self, key, cost=1):
+        """Take `cost` tokens from the key's bucket, False if there aren't enough
+        (and it isn't full)"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now, 0, 0]
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+
+            if bucket[0] >= cost or bucket[0] >= self.burst:
+                bucket[0] -= cost
+                bucket[2] += cost
+                self.allowed += cost
+                return True
+
+            bucket[3] += cost
+            self.throttled += cost
+            return False
+
+    def stats(self, top=10):
+        """Totals plus the most throttled keys"""
+        with self._lock:
+            throttled = sorted(
+                ((key, b[2], b[3]) for key, b in self._buckets.items() if b[3]),
+                key=lambda item: item[2], reverse=True
+            )[:top]
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'keys': len(self._buckets),
+                'allowed': self.allowed,
+                'throttled': self.throttled,
+                'top_throttled': [
+                    {'key': key, 'allowed': allowed, 'throttled': count}
+                    for key, allowed, count in throttled
+                ],
+            }
+
+
+def entry_cost(entry):
+    """Number of events an entry will produce"""
+    return sum(len(items) for items in (entry.get('messaging'), entry.get('changes')) if isinstance(items, list)) or 1
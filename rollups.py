@@ -0,0 +1,121 @@
+import time
+import threading
+from array import array
+from collections import OrderedDict
+
+# Bucket widths in seconds for each resolution
+RESOLUTIONS = {'minute': 60, 'hour': 3600}
+
+# Key under which every account's events are also counted
+ALL_ACCOUNTS = '*'
+
+
+class RingCounter:
+    """Fixed number of time buckets reused in a ring.
+
+    Each slot remembers which bucket it last counted, so a stale slot is reset
+    the first time it's reused and reads as zero until then.
+    """
+
+    __slots__ = ('width', 'counts', 'stamps')
+
+    def __init__(self, slots, width):
+        self.width = width
+        self.counts = array('I', [0]) * slots
+        self.stamps = array('q', [-1]) * slots
+
+    def add(self, now, count=1):
+        bucket = int(now // self.width)
+        i = bucket % len(self.counts)
+        if self.stamps[i] != bucket:
+            self.stamps[i] = bucket
+            self.counts[i] = 0
+        self.counts[i] += count
+
+    def series(self, now, points):
+        """Counts for the last `points` buckets, oldest first"""
+        slots = len(self.counts)
+        last = int(now // self.width)
+        return [
+            self.counts[bucket % slots] if self.stamps[bucket % slots] == bucket else 0
+            for bucket in range(last - min(points, slots) + 1, last + 1)
+        ]
+
+    def nbytes(self):
+        return self.counts.itemsize * len(self.counts) + self.stamps.itemsize * len(self.stamps)
+
+
+class Rollups:
+    """Per-minute and per-hour event counts keyed by (account id, field).
+
+    Every event also counts towards (ALL_ACCOUNTS, field). Keys are kept in an
+    LRU dict bounded by `max_keys`, each holding one ring per resolution, so
+    memory is fixed at roughly max_keys * (minutes + hours) * 12 bytes.
+    """
+
+    def __init__(self, minutes=360, hours=168, max_keys=1000):
+        self.slots = {'minute': minutes, 'hour': hours}
+        self.max_keys = max_keys
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def record(self, account, field, count=1, now=None):
+        """Count `count` events for (account, field) in O(1)"""
+        now = time.time() if now is None else now
+        with self._lock:
+            for key in ((account or '', field), (ALL_ACCOUNTS, field)):
+                rings = self._keys.get(key)
+                if rings is None:
+                    rings = self._keys[key] = tuple(
+                        RingCounter(self.slots[name], width) for name, width in RESOLUTIONS.items()
+                    )
+                    if len(self._keys) > self.max_keys:
+                        self._keys.popitem(last=False)
+                        self.evicted += 1
+                else:
+                    self._keys.move_to_end(key)
+                for ring in rings:
+                    ring.add(now, count)
+
+    def series(self, resolution, points, account=None, field=None, limit=20, now=None):
+        """Busiest matching keys over the last `points` buckets, each with its counts"""
+        now = time.time() if now is None else now
+        index = list(RESOLUTIONS).index(resolution)
+        with self._lock:
+            matches = [
+                (key, rings[index].series(now, points)) for key, rings in self._keys.items()
+                if (account is None or key[0] == account) and (field is None or key[1] == field)
+            ]
+
+        results = [
+            {'account': key[0], 'field': key[1], 'total': sum(counts), 'counts': counts}
+            for key, counts in matches
+        ]
+        results.sort(key=lambda result: result['total'], reverse=True)
+        return [result for result in results if result['total']][:limit]
+
+    def snapshot(self):
+        with self._lock:
+            return {'slots': dict(self.slots), 'keys': list(self._keys.items())}
+
+    def restore(self, state):
+        """Bring back the rings of a previous process, if they were sized the same"""
+        if state['slots'] != self.slots:
+            return 0
+        with self._lock:
+            for key, rings in reversed(state['keys']):
+                if key not in self._keys and len(self._keys) < self.max_keys:
+                    self._keys[key] = rings
+                    self._keys.move_to_end(key, last=False)
+            return len(self._keys)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'keys': len(self._keys),
+                'max_keys': self.max_keys,
+                'evicted': self.evicted,
+                'retention': {name: f'{slots} {name}s' for name, slots in self.slots.items()},
+                'memory_bytes': sum(ring.nbytes() for rings in self._keys.values() for ring in rings),
+            }
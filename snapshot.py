@@ -0,0 +1,135 @@
+import os
+import time
+import pickle
+import logging
+import threading
+
+from perprocess import PerProcess
+
+logger = logging.getLogger(__name__)
+
+
+class StateSnapshot:
+    """Saves in-process state on shutdown and restores it in the background on start.
+
+    `parts` maps a name to an object with snapshot() and restore(state). Each
+    process writes its own `snapshot-<pid>.pickle` into `directory`, along with
+    deliveries that were still queued. On start every process claims at most
+    one snapshot by renaming it, restores the parts, then hands the pending
+    deliveries to `on_pending`. Restoring happens in a thread so requests that
+    don't touch state (webhook verification, /health) are answered at once;
+    processing calls wait() first. Snapshots are only ever read by this app.
+
+    Only serving processes call start_restore(), so one-off commands that
+    import the app (replay, bench) neither claim nor write snapshots.
+    """
+
+    def __init__(self, directory, parts, on_pending=None):
+        self.directory = directory
+        self.parts = parts
+        self.on_pending = on_pending
+        self._ready = threading.Event()
+        self._restoring = PerProcess(self._start_restore)
+
+        self.restored_from = None
+        self.restored_parts = {}
+        self.restored_pending = 0
+        self.restore_seconds = None
+        self.save_seconds = None
+
+    def start_restore(self):
+        """Restore the newest unclaimed snapshot in a background thread (no-op if started)"""
+        self._restoring.ensure()
+
+    def active(self):
+        """Whether this process restored, and so should save, a snapshot"""
+        return self._restoring.started()
+
+    def _start_restore(self):
+        threading.Thread(target=self._restore, name='snapshot-restore', daemon=True).start()
+
+    def ready(self):
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        """Block until state has been restored, returns False on timeout"""
+        if not self.active():
+            return True
+        return self._ready.wait(timeout)
+
+    def save(self, pending=()):
+        """Write every part plus `pending` (payload, signature_valid) deliveries to disk"""
+        started = time.perf_counter()
+        state = {
+            'saved_at': time.time(),
+            'parts': {name: part.snapshot() for name, part in self.parts.items()},
+            'pending': list(pending),
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'snapshot-{os.getpid()}.pickle')
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+        self.save_seconds = time.perf_counter() - started
+        logger.info(f"Saved state snapshot to {path} in {self.save_seconds * 1000:.0f} ms "
+                    f"({len(state['pending'])} pending deliveries)")
+        return path
+
+    def stats(self):
+        return {
+            'directory': self.directory,
+            'ready': self.ready(),
+            'restored_from': self.restored_from,
+            'restored': self.restored_parts,
+            'restored_pending': self.restored_pending,
+            'restore_ms': round(self.restore_seconds * 1000, 1) if self.restore_seconds is not None else None,
+        }
+
+    def _claim(self):
+        # Renaming is atomic, so each snapshot is restored by exactly one process
+        try:
+            names = sorted(n for n in os.listdir(self.directory) if n.endswith('.pickle'))
+        except OSError:
+            return None, None
+        for name in reversed(names):
+            path = os.path.join(self.directory, name)
+            claimed = f'{path}.{os.getpid()}.restoring'
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            return name, claimed
+        return None, None
+
+    def _restore(self):
+        started = time.perf_counter()
+        pending = []
+        try:
+            name, claimed = self._claim()
+            if claimed is not None:
+                with open(claimed, 'rb') as f:
+                    state = pickle.load(f)
+                os.remove(claimed)
+
+                for part_name, part_state in state['parts'].items():
+                    part = self.parts.get(part_name)
+                    if part is not None and part_state is not None:
+                        self.restored_parts[part_name] = part.restore(part_state)
+                pending = state['pending']
+                self.restored_from = name
+        except Exception as e:
+            logger.error(f"Failed to restore state snapshot: {str(e)}")
+        finally:
+            self.restore_seconds = time.perf_counter() - started
+            self._ready.set()
+
+        if self.restored_from:
+            logger.info(f"Restored state snapshot {self.restored_from} in {self.restore_seconds * 1000:.0f} ms")
+
+        # Processing waits for the restore, so pending deliveries go last
+        for payload, signature_valid in pending:
+            self.on_pending(payload, signature_valid)
+        self.restored_pending = len(pending)
@@ -0,0 +1,108 @@
+import os
+import json
+import hmac
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Tenant:
+    """One Meta app: its verify token and precomputed HMAC key state"""
+
+    __slots__ = ('app_id', 'verify_token', 'hmac_base')
+
+    def __init__(self, app_id, verify_token, app_secret):
+        self.app_id = app_id
+        self.verify_token = verify_token
+        self.hmac_base = hmac.new(app_secret.encode('utf-8'), digestmod=hashlib.sha256) if app_secret else None
+
+
+def _load_json(path):
+    # {"<app_id>": {"verify_token": ..., "app_secret": ...}, ...}
+    with open(path) as f:
+        apps = json.load(f)
+    return [(str(app_id), conf.get('verify_token', ''), conf.get('app_secret', '')) for app_id, conf in apps.items()]
+
+
+def _load_sqlite(path):
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        rows = conn.execute('SELECT app_id, verify_token, app_secret FROM apps').fetchall()
+    finally:
+        conn.close()
+    return [(str(app_id), verify_token or '', app_secret or '') for app_id, verify_token, app_secret in rows]
+
+
+class TenantRegistry:
+    """Per-app credentials for /webhook/<app_id>, cached in a dict.
+
+    The source is a JSON file or, for paths ending in .db/.sqlite, an SQLite
+    database with an `apps(app_id, verify_token, app_secret)` table. HMAC key
+    state is built once per app at load time. The file's mtime is checked at
+    most every `check_interval` seconds and the whole table is swapped in when
+    it changes; a source that fails to load leaves the previous table in place.
+    """
+
+    def __init__(self, path, check_interval=2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.backend = 'sqlite' if path.endswith(('.db', '.sqlite')) else 'json'
+        self._tenants = {}
+        self._mtime = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self.reloads = 0
+        self.errors = 0
+        self.last_reload = None
+        self._reload()
+
+    def get(self, app_id):
+        """Tenant for app_id, or None if it isn't configured"""
+        if time.monotonic() >= self._next_check:
+            self._check()
+        return self._tenants.get(app_id)
+
+    def stats(self):
+        return {
+            'source': self.path,
+            'backend': self.backend,
+            'apps': len(self._tenants),
+            'reloads': self.reloads,
+            'errors': self.errors,
+            'last_reload': self.last_reload,
+        }
+
+    def _source_mtime(self):
+        # WAL-mode writes land in the -wal file until a checkpoint
+        paths = (self.path, self.path + '-wal') if self.backend == 'sqlite' else (self.path,)
+        mtimes = [os.stat(p).st_mtime_ns for p in paths if os.path.exists(p)]
+        return max(mtimes) if mtimes else None
+
+    def _check(self):
+        with self._lock:
+            if time.monotonic() < self._next_check:
+                return
+            self._next_check = time.monotonic() + self.check_interval
+            if self._source_mtime() != self._mtime:
+                self._reload()
+
+    def _reload(self):
+        mtime = self._source_mtime()
+        try:
+            rows = _load_sqlite(self.path) if self.backend == 'sqlite' else _load_json(self.path)
+        except (OSError, ValueError, AttributeError, sqlite3.Error) as e:
+            self.errors += 1
+            self._mtime = mtime
+            logger.error(f"Failed to load app config from {self.path}: {str(e)}")
+            return
+
+        # Readers only ever see a complete table
+        self._tenants = {app_id: Tenant(app_id, token, secret) for app_id, token, secret in rows}
+        self._mtime = mtime
+        self.reloads += 1
+        self.last_reload = time.time()
+        logger.info(f"Loaded {len(self._tenants)} app(s) from {self.path}")